@@ -0,0 +1,211 @@
+# Offline benchmark suite of the MetaStrategy libs: the hot functions and the meta() / leveraged_meta() pipelines are timed on seeded synthetic
+# price panels (no YF or price store access), for several ticker counts, history lengths and rebalance units. The results are saved as JSON,
+# the files of two commits can be compared by compare_benchmarks().
+# Usage: python benchmark_lib.py [result.json] or run_benchmarks(...) from a notebook. Short configs: run_benchmarks([10], [5], ['Month'], 1).
+# Import budget of the live modules: python benchmark_lib.py imports [budget seconds] (exit code 1 over the budget) or import_budget_check().
+
+import sys
+import os
+import json
+import time
+import datetime as dt
+import platform
+import subprocess
+import pandas as pd
+import numpy as np
+import common_aa_pv as com
+import common_price_store as cps
+import common_calendar as ccal
+import common_feature_store as cfs
+import taa_lib
+import dualmom_opt3_lib
+import meta_lib
+import leveraged_meta_lib
+import param_sweep_lib
+
+# the tickers of the default parameters, the pipelines always use this universe (the extra synthetic tickers are only used by the function benchmarks)
+meta_universe = ['AGG', 'BIL', 'BNDX', 'DBC', 'EEM', 'EFA', 'EMB', 'EWJ', 'GLD', 'HYG', 'IEF', 'IWM', 'LQD', 'QQQ', 'SHY', 'SPY', 'TIP', 'TLT', 'VEA', 'VGK', 'VNQ', 'VWO']
+# the modules imported by the live signal script and the parallel workers, and the heavy / optional packages they must not load at import time
+live_modules = ['leveraged_meta_windowed_lib', 'leveraged_meta_lib', 'meta_lib']
+deferred_packages = ['pyfolio', 'matplotlib', 'yfinance', 'pandas_datareader', 'scipy', 'IPython', 'pandas_market_calendars', 'plotly']
+rebalance_unit_keys = ['meta_rebalance_unit', 'taa_rebalance_unit', 'baa_rebalance_unit', 'dm_rebalance_unit', 'protmom_rebalance_unit', 'tactbond_rebalance_unit', 'haa_rebalance_unit']
+
+def default_parameters(start_date, end_date):
+    # The parameters of meta.ipynb with fixed dates, {dict name : parameter dict} in the order of param_sweep_lib.parameter_dict_names.
+    meta_parameters = {'meta_rebalance_unit' : 'Month', 'meta_rebalance_freq' : 1, 'meta_rebalance_shift' : 0, 'meta_lb_period' : 3, 'meta_skipped_period' : 0,
+        'meta_fixed_substrat_weights' : {'DualMom' : 2, 'BAA_AggDef' : 2, 'BAA_BalDef' : 2, 'TAA' : 2, 'KellerProtMom' : 2, 'NovellTactBond' : 1, 'HAA' : 1},
+        'meta_rel_mom_substrat_weights' : [1, 2, 3, 4, 5, 6, 7], 'meta_sharpe_substrat_weights' : [1, 2, 3, 4, 5, 6, 7], 'meta_sortino_substrat_weights' : [1, 2, 3, 4, 5, 6, 7],
+        'meta_rel_mom_abs_threshold' : -1, 'meta_sharpe_abs_threshold' : -100, 'meta_sortino_abs_threshold' : -100,
+        'meta_start_date' : start_date, 'meta_end_date' : end_date, 'used_substrat_weights' : 'fixed_based'}
+    taa_parameters = {'taa_ticker_list' : ['VNQ', 'EEM', 'DBC', 'SPY', 'QQQ', 'TLT'], 'taa_perc_ch_lb_list' : [60, 120, 180, 250], 'taa_vol_lb' : 20, 'taa_perc_ch_up_thres' : 0.75, 'taa_perc_ch_low_thres' : 0.25,
+        'taa_rebalance_unit' : 'Month', 'taa_rebalance_freq' : 1, 'taa_rebalance_shift' : 0}
+    bold_parameters = {'baa_ticker_list_canary' : ['SPY', 'EEM', 'EFA', 'AGG'], 'baa_ticker_list_defensive' : ['TIP', 'DBC', 'BIL', 'IEF', 'TLT', 'LQD', 'AGG'], 'baa_ticker_list_aggressive' : ['QQQ', 'EEM', 'EFA', 'AGG'],
+        'baa_ticker_list_balanced' : ['SPY', 'QQQ', 'IWM', 'VGK', 'EWJ', 'EEM', 'VNQ', 'DBC', 'GLD', 'TLT', 'HYG', 'LQD'], 'baa_rebalance_unit' : 'Month', 'baa_rebalance_freq' : 1, 'baa_rebalance_shift' : 0, 'baa_skipped_period' : 0,
+        'baa_no_played_ETFs' : {'offAgg' : 1, 'offBal' : 6, 'def' : 3}, 'baa_abs_threshold' : -1}
+    dual_mom_parameters = {'dm_tickers_list' : ['VNQ', 'EEM', 'DBC', 'SPY', 'TLT', 'SHY'], 'dm_rebalance_unit' : 'Month', 'dm_rebalance_freq' : 1, 'dm_rebalance_shift' : 0, 'dm_lb_period' : 4, 'dm_skipped_period' : 0, 'dm_no_played_ETFs' : 3,
+        'dm_sub_rank_weights' : {'relMom' : 0.5, 'volatility' : 0.25, 'correlation' : 0.25}, 'dm_abs_threshold' : 0}
+    keller_protmom_parameters = {'protmom_tickers_list' : ['SPY', 'QQQ', 'IWM', 'VNQ', 'DBC', 'GLD', 'HYG', 'LQD', 'TLT'], 'protmom_rebalance_unit' : 'Month', 'protmom_rebalance_freq' : 1, 'protmom_rebalance_shift' : 0,
+        'protmom_correl_lb_months' : 12, 'protmom_lb_periods' : [1, 3, 6, 12], 'protmom_lb_weights' : [1, 1, 1, 1], 'protmom_selected_ETFs' : 3}
+    novell_tactbond_parameters = {'tactbond_tickers_list' : ['BNDX', 'EMB', 'HYG', 'IEF', 'LQD', 'SHY', 'TIP', 'TLT'], 'tactbond_rebalance_unit' : 'Month', 'tactbond_rebalance_freq' : 1, 'tactbond_rebalance_shift' : 0,
+        'tactbond_absolute_threshold' : 0, 'tactbond_threshold_type' : 1, 'tactbond_cash_subs' : 1, 'tactbond_lb_periods' : [1, 3, 6, 12], 'tactbond_lb_weights' : [0, 0, 1, 0], 'tactbond_selected_ETFs' : 3}
+    meta_leverage_parameters = {'meta_overall_leverage' : 1, 'meta_ETF_perf_leverage_threshold' : [0.2, 0.4, 0.6, 0.8, 1], 'meta_ETF_perf_leverage' : [1.5, 1.25, 1, 0.85, 0.7],
+        'meta_monthly_seas_based_leverage' : [1.5, 1.5, 1.25, 1.25, 1, 1, 1, 1, 1, 1, 0.85, 0.85], 'meta_leverage_lookback_years' : 5, 'meta_tlt_based_leverage' : [1.25, 1.4, 1, 0.75],
+        'meta_tip_based_leverage' : {ticker : ([0.5, 1, 1.5, 1, 1] if ticker in ['DBC', 'EEM', 'EFA', 'IWM', 'VEA', 'VGK', 'VNQ', 'VWO'] else [1, 1.25, 1.5, 1.25, 1] if ticker in ['QQQ', 'SPY'] else [1, 1, 1, 1, 1]) for ticker in meta_universe}}
+    haa_parameters = {'haa_ticker_list_canary' : ['TIP'], 'haa_ticker_list_defensive' : ['BIL', 'IEF'], 'haa_ticker_list_offensive' : ['SPY', 'IWM', 'VWO', 'VEA', 'VNQ', 'DBC', 'IEF', 'TLT'],
+        'haa_rebalance_unit' : 'Month', 'haa_rebalance_freq' : 1, 'haa_rebalance_shift' : 0, 'haa_skipped_period' : 0, 'haa_no_played_ETFs' : {'off' : 4, 'def' : 1}, 'haa_abs_threshold' : 0}
+    return {'meta_parameters' : meta_parameters, 'taa_parameters' : taa_parameters, 'bold_parameters' : bold_parameters, 'dual_mom_parameters' : dual_mom_parameters,
+        'keller_protmom_parameters' : keller_protmom_parameters, 'novell_tactbond_parameters' : novell_tactbond_parameters, 'meta_leverage_parameters' : meta_leverage_parameters, 'haa_parameters' : haa_parameters}
+
+def synthetic_panel(ticker_list, start_date, end_date, seed = 1):
+    # Seeded geometric random walk prices on the business days, a stand-in for the YF adjusted close panel. The same arguments give the same panel.
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start_date, end_date, name = 'Date')
+    drifts = rng.normal(0.0003, 0.0002, len(ticker_list))
+    vols = rng.uniform(0.003, 0.02, len(ticker_list))
+    daily_rets = rng.normal(drifts, vols, (len(dates), len(ticker_list)))
+    return pd.DataFrame(50 * np.exp(np.cumsum(daily_rets, axis = 0)), index = dates, columns = ticker_list)
+
+def clear_caches():
+    # every repeat starts cold, so the timings don't depend on the previous benchmarks
+    cfs.default_store.clear()
+    ccal.calendar_cache.clear()
+
+def time_call(func, repeats):
+    times = []
+    for no_repeat in range(repeats):
+        clear_caches()
+        np.random.seed(1) # the leverage overlay breaks rank ties randomly
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'best' : min(times), 'mean' : float(np.mean(times)), 'repeats' : repeats}
+
+def function_benchmarks(adj_close_price, rebalance_unit):
+    # {benchmark name : no-argument function} of the hot functions on a price panel
+    no_rows, no_cols = adj_close_price.shape
+    rng = np.random.default_rng(1)
+    rebalance = ccal.rebalance_days(adj_close_price.index, rebalance_unit, 1, 0)
+    weights = pd.DataFrame(rng.random((no_rows, no_cols)), index = adj_close_price.index, columns = adj_close_price.columns)
+    weights = weights.divide(weights.sum(axis = 1), axis = 0) * 0.9
+    cash_weight = 1 - weights.sum(axis = 1)
+    start_date = adj_close_price.index[0]
+    dailyret = adj_close_price / adj_close_price.shift(1) - 1
+    total_rank = weights.rank(axis = 1, ascending = True)
+    number_of_ETFs = pd.Series(min(6, no_cols), index = adj_close_price.index)
+    substrats = ['DualMom', 'BAA_AggDef', 'BAA_BalDef', 'TAA', 'KellerProtMom', 'NovellTactBond', 'HAA']
+    performance = pd.DataFrame(rng.normal(0, 1, (no_rows, len(substrats))), index = adj_close_price.index, columns = substrats)
+    substrat_rank = performance.rank(axis = 1, ascending = False)
+    pv = pd.DataFrame({'PV' : adj_close_price.mean(axis = 1).to_numpy()}, index = adj_close_price.index)
+    return {
+        'positions_pv' : lambda: com.positions_pv(adj_close_price, rebalance, weights, cash_weight, start_date),
+        'positions_pv_ew' : lambda: com.positions_pv_ew(adj_close_price, rebalance, start_date),
+        'taa_scores' : lambda: [taa_lib.scores(adj_close_price, lb, 0.25, 0.75) for lb in [60, 120, 180, 250]],
+        'rolling_avg_corr' : lambda: com.rolling_avg_corr(dailyret, 84),
+        'opt3corr' : lambda: dualmom_opt3_lib.opt3corr(dailyret, total_rank, number_of_ETFs, 84),
+        'meta_perf_based_weights' : lambda: meta_lib.meta_perf_based_weights(substrat_rank, [1, 2, 3, 4, 5, 6, 7], performance, -100),
+        'yearly_sharpe' : lambda: leveraged_meta_lib.yearly_sharpe(pv),
+        'feature_store_std' : lambda: cfs.default_store.feature(adj_close_price, 'std', 20),
+    }
+
+def pipeline_benchmarks(parameters, price_provider):
+    parameter_dicts = [parameters[dict_name] for dict_name in param_sweep_lib.parameter_dict_names]
+    meta_parameter_dicts = [parameters[dict_name] for dict_name in param_sweep_lib.parameter_dict_names if dict_name != 'meta_leverage_parameters']
+    return {
+        'meta' : lambda: meta_lib.meta(*meta_parameter_dicts, price_provider),
+        'leveraged_meta' : lambda: leveraged_meta_lib.leveraged_meta(*parameter_dicts, price_provider),
+    }
+
+def run_case(benchmarks, case, repeats, results):
+    for name, func in benchmarks.items():
+        try:
+            timing = time_call(func, repeats)
+        except Exception as e:
+            print(f'SqError. Benchmark {name} {case} failed. {type(e).__name__}: {e}')
+            timing = {'best' : np.nan, 'mean' : np.nan, 'repeats' : repeats, 'error' : f'{type(e).__name__}: {e}'}
+        results.append({'benchmark' : name, **case, **timing})
+        print(f"{name} {case}: best {timing['best']:.4f}s, mean {timing['mean']:.4f}s")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__)), timeout = 10).stdout.strip() or None
+    except Exception:
+        return None
+
+def run_benchmarks(ticker_counts = [10, 22, 50], year_counts = [5, 10, 20], rebalance_units = ['Month', 'Week'], repeats = 3, result_path = None, seed = 1, end_date = '2024-06-28'):
+    # ticker_counts: columns of the function benchmark panels (the meta tickers and extra 'SYN###' tickers), the pipelines always run on the meta universe.
+    # year_counts: played years, the panels have 2 more years for the lookbacks. rebalance_units: applied to all the strategies of the pipelines.
+    end = pd.to_datetime(end_date)
+    results = []
+    for no_years in year_counts:
+        start = end + pd.DateOffset(years = -no_years)
+        panel_start = start + pd.DateOffset(years = -2)
+        for no_tickers in ticker_counts:
+            tickers = (meta_universe + [f'SYN{no:03d}' for no in range(max(no_tickers - len(meta_universe), 0))])[:no_tickers]
+            adj_close_price = synthetic_panel(tickers, panel_start, end, seed)
+            for rebalance_unit in rebalance_units:
+                run_case(function_benchmarks(adj_close_price, rebalance_unit), {'tickers' : no_tickers, 'years' : no_years, 'rebalance_unit' : rebalance_unit, 'rows' : len(adj_close_price.index)}, repeats, results)
+        price_provider = cps.PanelPriceProvider(synthetic_panel(meta_universe, panel_start, end, seed))
+        for rebalance_unit in rebalance_units:
+            parameters = default_parameters(start.strftime('%Y-%m-%d'), end.date())
+            for key in rebalance_unit_keys:
+                for parameter_dict in parameters.values():
+                    if key in parameter_dict:
+                        parameter_dict[key] = rebalance_unit
+            run_case(pipeline_benchmarks(parameters, price_provider), {'tickers' : len(meta_universe), 'years' : no_years, 'rebalance_unit' : rebalance_unit}, repeats, results)
+
+    report = {
+        'created' : dt.datetime.now().isoformat(timespec = 'seconds'),
+        'git_commit' : git_commit(),
+        'versions' : {'python' : platform.python_version(), 'numpy' : np.__version__, 'pandas' : pd.__version__, 'machine' : platform.machine(), 'cpu_count' : os.cpu_count()},
+        'config' : {'ticker_counts' : ticker_counts, 'year_counts' : year_counts, 'rebalance_units' : rebalance_units, 'repeats' : repeats, 'seed' : seed, 'end_date' : str(end.date())},
+        'results' : [{key : (None if isinstance(value, float) and np.isnan(value) else value) for key, value in result.items()} for result in results],
+    }
+    if result_path is not None:
+        with open(result_path, 'w') as result_file:
+            json.dump(report, result_file, indent = 1)
+    return report
+
+def compare_benchmarks(old_path, new_path):
+    # The best times of two benchmark files side by side, speedup = old / new (above 1: the new commit is faster).
+    case_columns = ['benchmark', 'tickers', 'years', 'rebalance_unit']
+    frames = []
+    for path in [old_path, new_path]:
+        with open(path) as result_file:
+            frames.append(pd.DataFrame(json.load(result_file)['results'])[case_columns + ['best']])
+    comparison = frames[0].merge(frames[1], on = case_columns, how = 'outer', suffixes = ('_old', '_new'))
+    comparison['speedup'] = comparison['best_old'] / comparison['best_new']
+    return comparison
+
+def import_times(module):
+    # python -X importtime of the module in a fresh interpreter: one row per imported module with the self and cumulative (with its imports) seconds
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__)), timeout = 120)
+    if process.returncode != 0:
+        raise RuntimeError(f'SqError. Importing {module} failed. {process.stderr.strip().splitlines()[-1] if process.stderr.strip() else ""}')
+    rows = []
+    for line in process.stderr.splitlines():
+        fields = line[len('import time:'):].split('|') if line.startswith('import time:') else []
+        if len(fields) == 3 and fields[0].strip().isdigit():
+            rows.append({'module' : fields[2].strip(), 'depth' : (len(fields[2]) - len(fields[2].lstrip()) - 1) // 2, 'self_s' : int(fields[0]) / 1e6, 'cumulative_s' : int(fields[1]) / 1e6})
+    return pd.DataFrame(rows, columns = ['module', 'depth', 'self_s', 'cumulative_s'])
+
+def import_budget_check(modules = live_modules, budget_s = 1.0, top_n = 10, repeats = 3):
+    # Each module is imported in a fresh interpreter repeats times (the first run can include compiling the .pyc files), the fastest run is kept.
+    # The import is over the budget if it takes more than budget_s seconds or loads a deferred package. Prints the slowest top_n imports of each module.
+    report = {'budget_s' : budget_s, 'within_budget' : True, 'modules' : {}}
+    for module in modules:
+        times = min((import_times(module) for _ in range(repeats)), key = lambda frame: frame.loc[frame['module'] == module, 'cumulative_s'].max())
+        seconds = times.loc[times['module'] == module, 'cumulative_s'].max()
+        loaded = sorted(set(times['module'].str.split('.').str[0]) & set(deferred_packages))
+        slowest = times.sort_values('cumulative_s', ascending = False).head(top_n)
+        within_budget = seconds <= budget_s and len(loaded) == 0
+        report['within_budget'] = report['within_budget'] and within_budget
+        report['modules'][module] = {'seconds' : seconds, 'within_budget' : within_budget, 'deferred_loaded' : loaded, 'slowest' : slowest.to_dict('records')}
+        print(f'{module}: {seconds:.3f}s (budget {budget_s:.3f}s)' + ('' if within_budget else ' SqError. Over the import budget.') + (f' Loads the deferred {loaded}.' if loaded else ''))
+        for row in slowest.itertuples():
+            print(f'    {row.cumulative_s:8.3f}s cumulative {row.self_s:8.3f}s self  {row.module}')
+    return report
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'imports':
+        sys.exit(0 if import_budget_check(budget_s = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0)['within_budget'] else 1)
+    run_benchmarks(result_path = sys.argv[1] if len(sys.argv) > 1 else 'benchmark_results.json')
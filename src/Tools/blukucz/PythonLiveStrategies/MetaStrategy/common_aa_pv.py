@@ -1,38 +1,73 @@
 # Importing necessary libraries
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import yfinance as yf
-import pyfolio as pf
-import datetime as dt
-import pandas_datareader.data as web
-import os
+import functools
+
+def value_dtype(frame_p):
+    # The dtype of the position arrays and cached features: float32 for a compact (float32) price panel, float64 otherwise. PVs and cash are always float64.
+    dtypes = list(frame_p.dtypes) if isinstance(frame_p, pd.DataFrame) else [frame_p.dtype]
+    return np.float32 if len(dtypes) > 0 and all(dtype == np.float32 for dtype in dtypes) else np.float64
+
+def segment_pv(adjclose, rebalanceday, weights, cash_weight, start_ind, idle_cash, buy_price = None):
+    # Positions only change on the day after a rebalance day, so each rebalance opens a segment with constant positions bought with the PV of the anchor
+    # (rebalance) day. The arithmetic is the one of the former day loop (pv * weight / price, the PV summed over the assets in column order), so the PVs
+    # are equal to it bit for bit: the rounding noise decides the rank ties of the equal performing substrategies in meta().
+    # Only the PV at the segment ends is chained day by day (scalar float recurrence of the segments), then all the days are calculated at once.
+    # weights is (K portfolios x T days x N assets) and cash_weight is (K x T), all K portfolios share the price panel.
+    # The positions have the dtype of adjclose (float32 in compact mode), the PVs are calculated in float64.
+    buy_price = adjclose if buy_price is None else buy_price
+    no_rows, no_cols = adjclose.shape
+    no_ports = weights.shape[0]
+    positions = np.zeros((no_ports, no_rows, no_cols), dtype = adjclose.dtype)
+    pv = np.ones((no_ports, no_rows))
+    cash = np.ones((no_ports, no_rows))
+    pv[:, start_ind:] = idle_cash # before the first rebalance only the initial cash is carried forward
+    cash[:, start_ind:] = idle_cash
+
+    rows = np.arange(start_ind, no_rows)
+    seg_starts = rows[rebalanceday[rows - 1]]
+    if len(seg_starts) == 0:
+        return positions, cash, pv
+    anchors = seg_starts - 1 # a start on the first day rebalances the initial PV of 1 (the last row in the loop)
+    seg_ends = np.append(seg_starts[1:], no_rows) - 1
+    first_row = seg_starts[0]
+    first_base = idle_cash if first_row > start_ind else 1
+
+    seg_base = np.empty((no_ports, len(seg_starts))) # PV of the anchor days
+    seg_buy_prices, seg_end_prices = buy_price[anchors].tolist(), adjclose[seg_ends].tolist()
+    for k in range(no_ports):
+        base = float(first_base)
+        for seg, (seg_weights, seg_cash_weight, seg_buy_price, seg_end_price) in enumerate(zip(weights[k, anchors].tolist(), cash_weight[k, anchors].tolist(), seg_buy_prices, seg_end_prices)):
+            seg_base[k, seg] = base
+            end_pv = 0.0
+            for weight, bought_at, price in zip(seg_weights, seg_buy_price, seg_end_price):
+                end_pv += base * weight / bought_at * price
+            base = end_pv + base * seg_cash_weight
+
+    live_rows = np.arange(first_row, no_rows)
+    row_anchors = anchors[np.searchsorted(seg_starts, live_rows, side = 'right') - 1]
+    row_base = np.repeat(seg_base, np.diff(np.append(seg_starts, no_rows)), axis = 1)
+    live_pos = row_base[:, :, None] * weights[:, row_anchors] / buy_price[row_anchors]
+    live_cash = row_base * cash_weight[:, row_anchors]
+    live_pv = np.zeros((no_ports, len(live_rows)))
+    for j in range(no_cols):
+        live_pv += live_pos[:, :, j] * adjclose[live_rows, j]
+    positions[:, first_row:] = live_pos
+    cash[:, first_row:] = live_cash
+    pv[:, first_row:] = live_pv + live_cash
+    return positions, cash, pv
 
 def positions_pv(acp_p, rebalance_p, weights_p, cash_weight_p, start_date_p):
-    adjclose = acp_p.fillna(1).to_numpy()
-    rebalanceday = rebalance_p.to_numpy()
-    weights = weights_p.fillna(0).to_numpy()
-    cash_weight = cash_weight_p.to_numpy()
+    adjclose = acp_p.fillna(1).to_numpy(dtype = value_dtype(acp_p))
+    rebalanceday = np.asarray(rebalance_p, dtype = bool)
     no_rows, no_cols = acp_p.shape
+    weights = weights_p.fillna(0).to_numpy(dtype = adjclose.dtype)[:, :no_cols] # extra weight columns (e.g. 'cash') are not positions
+    cash_weight = cash_weight_p.to_numpy(dtype = float)
 
-    positions = np.zeros((no_rows, no_cols))
-    pv = np.ones((no_rows,1))
-    cash = np.ones((no_rows,1))
     start_ind = np.argmax(acp_p.index >= start_date_p)
-    for i in range(start_ind, no_rows):
-        pv[i] = 0
-        for j in range(no_cols):
-            if rebalanceday[i-1] == True:
-                positions[i,j] = pv[i-1] * weights[i-1,j] / adjclose[i-1,j]                
-            else:
-                positions[i,j] = positions[i-1,j]
-            pv[i] += positions[i,j] * adjclose[i,j]
-        if rebalanceday[i-1] == True:
-            cash[i] = pv[i-1] * cash_weight[i-1]
-        else:
-            cash[i] = cash[i-1]
-        pv[i] += cash[i] 
-    
+    positions, cash, pv = segment_pv(adjclose, rebalanceday, weights[None], cash_weight[None], start_ind, 1)
+    positions, cash, pv = positions[0], cash[0], pv[0]
+
     positions_df = pd.DataFrame(positions, index = acp_p.index, columns = acp_p.columns)
     positions_df_sel = positions_df.iloc[start_ind-1:no_rows,:]
     pv_df =  pd.DataFrame(pv, index = acp_p.index)
@@ -41,34 +76,234 @@ def positions_pv(acp_p, rebalance_p, weights_p, cash_weight_p, start_date_p):
     cash_df_sel = cash_df.iloc[start_ind-1:no_rows,0]
     return positions_df_sel, cash_df_sel, pv_df_sel
 
+def positions_pv_stacked(acp_p, rebalance_p, weights_p, cash_weights_p, start_date_p):
+    # K weighting schemes simulated in one pass over the same price panel and rebalance days.
+    # weights_p: (K x T x N) array, cash_weights_p: (K x T) array; columns of the returned cash/pv frames are 0..K-1.
+    adjclose = acp_p.fillna(1).to_numpy(dtype = value_dtype(acp_p))
+    rebalanceday = np.asarray(rebalance_p, dtype = bool)
+    no_rows, no_cols = acp_p.shape
+    weights = np.nan_to_num(np.asarray(weights_p, dtype = adjclose.dtype)[:, :, :no_cols], nan = 0)
+    cash_weights = np.asarray(cash_weights_p, dtype = float)
+
+    start_ind = np.argmax(acp_p.index >= start_date_p)
+    positions, cash, pv = segment_pv(adjclose, rebalanceday, weights, cash_weights, start_ind, 1)
+
+    positions_sel = positions[:, start_ind-1:no_rows, :]
+    pv_df_sel = pd.DataFrame(pv.T, index = acp_p.index).iloc[start_ind-1:no_rows]
+    cash_df_sel = pd.DataFrame(cash.T, index = acp_p.index).iloc[start_ind-1:no_rows]
+    return positions_sel, cash_df_sel, pv_df_sel
+
+def positions_pv_multi(acp_p, rebalance_p, weights_dct_p, cash_weights_dct_p, start_date_p):
+    # Dictionary version of positions_pv_stacked: same keys in, positions_pv-like (positions, cash, pv) per key out.
+    keys = list(weights_dct_p.keys())
+    weights = np.stack([weights_dct_p[k].to_numpy(dtype = value_dtype(acp_p)) for k in keys])
+    cash_weights = np.stack([cash_weights_dct_p[k].to_numpy(dtype = float) for k in keys])
+    positions, cash_df, pv_df = positions_pv_stacked(acp_p, rebalance_p, weights, cash_weights, start_date_p)
+
+    pos_dct = {k : pd.DataFrame(positions[i], index = pv_df.index, columns = acp_p.columns) for i, k in enumerate(keys)}
+    cash_dct = {k : cash_df[i].rename(k) for i, k in enumerate(keys)}
+    pv_dct = {k : pv_df[i].rename(k) for i, k in enumerate(keys)}
+    return pos_dct, cash_dct, pv_dct
+
+def restarted_pvs(pvs_p, rebalance_p, start_date_p):
+    # The PVs of positions_pv* simulations (T x K frame) as if they were started with 1 cash on start_date_p, in the positions_pv format (from the day before).
+    # In segment_pv the cash is idle until the first rebalance after the start, from there the positions are the rebalanced ones of the original simulation,
+    # so the restarted PV is the original PV divided by its value on that rebalance (anchor) day. No prices or weights are needed.
+    # rebalance_p: the rebalance days of the simulations, T or T x K (one column per PV).
+    pvs = pvs_p.to_numpy(dtype = float)
+    no_rows, no_cols = pvs.shape
+    rebalanceday = np.broadcast_to(np.asarray(rebalance_p, dtype = bool).reshape(no_rows, -1), pvs.shape)
+    start_ind = max(np.argmax(pvs_p.index >= start_date_p), 1)
+    anchor_days = rebalanceday[start_ind-1:no_rows-1]
+    anchors = start_ind - 1 + anchor_days.argmax(axis = 0)
+    rows = np.arange(start_ind - 1, no_rows)[:, None]
+    restarted = np.where((rows > anchors) & anchor_days.any(axis = 0), pvs[start_ind-1:] / pvs[anchors, np.arange(no_cols)], 1)
+    return pd.DataFrame(restarted, index = pvs_p.index[start_ind-1:], columns = pvs_p.columns)
+
 def positions_pv_ew(acp_p, rebalance_p, start_date_p):
-    adjclose = acp_p.fillna(0).to_numpy()
-    rebalanceday = rebalance_p.to_numpy()
+    adjclose = acp_p.fillna(0).to_numpy(dtype = value_dtype(acp_p))
+    rebalanceday = np.asarray(rebalance_p, dtype = bool)
     no_rows, no_cols = acp_p.shape
-    no_ava_etfs = (acp_p > 0).sum(1)
+    no_ava_etfs = (acp_p > 0).sum(1).to_numpy()
 
-    positions = np.zeros((no_rows, no_cols))
-    pv = np.ones((no_rows,1))
-    cash = np.ones((no_rows,1))
+    # equal weights among the available ETFs, no cash; missing prices get no position
+    with np.errstate(divide = 'ignore'):
+        weights = np.where(adjclose > 0, 1 / no_ava_etfs[:, None], 0).astype(adjclose.dtype, copy = False)
+    buy_price = np.where(adjclose > 0, adjclose, 1)
     start_ind = np.argmax(acp_p.index >= start_date_p)
-    for i in range(start_ind, no_rows):
-        pv[i] = 0
-        for j in range(no_cols):
-            if rebalanceday[i-1] == True:
-                positions[i,j] = pv[i-1] * (1 / no_ava_etfs[i-1]) / adjclose[i-1,j] if adjclose[i-1, j] > 0 else 0                
-            else:
-                positions[i,j] = positions[i-1,j]
-            pv[i] += positions[i,j] * adjclose[i,j]
-        if rebalanceday[i-1] == True:
-            cash[i] = 0
-        else:
-            cash[i] = 0
-        pv[i] += cash[i] 
-    
+    positions, cash, pv = segment_pv(adjclose, rebalanceday, weights[None], np.zeros((1, no_rows)), start_ind, 0, buy_price)
+    positions, cash, pv = positions[0], cash[0], pv[0]
+
     positions_df = pd.DataFrame(positions, index = acp_p.index, columns = acp_p.columns)
     positions_df_sel = positions_df.iloc[start_ind-1:no_rows,:]
     pv_df =  pd.DataFrame(pv, index = acp_p.index)
     pv_df_sel = pv_df.iloc[start_ind-1:no_rows,0]
     cash_df =  pd.DataFrame(cash, index = acp_p.index)
     cash_df_sel = cash_df.iloc[start_ind-1:no_rows,0]
-    return positions_df_sel, cash_df_sel, pv_df_sel
\ No newline at end of file
+    return positions_df_sel, cash_df_sel, pv_df_sel
+
+# Lazy result of a (sub)strategy, in place of the former (pv, strat_rets, weights, pos, cash, curr_weights, pv_ew, strat_rets_ew, pos_ew, cash_ew) tuple.
+# The members are calculated on the first access and cached. meta() only reads pv, weights and curr_weights, so the EW benchmarks are never simulated there.
+# Unpacking or indexing it like the tuple calculates all the members. The loaders are partials of module functions, so a result can be sent to an other process.
+class StrategyResult:
+    __slots__ = ('loaders', 'members')
+    fields = ('pv', 'strat_rets', 'weights', 'pos', 'cash', 'curr_weights', 'pv_ew', 'strat_rets_ew', 'pos_ew', 'cash_ew')
+
+    def __init__(self, loaders):
+        # loaders: list of (member names, no-argument function returning {member : value}), e.g. all the members of one simulation come from one loader
+        self.loaders = {name : loader for names, loader in loaders for name in names}
+        self.members = {}
+
+    def __getattr__(self, name):
+        if name not in StrategyResult.fields:
+            raise AttributeError(f"'StrategyResult' object has no attribute '{name}'")
+        if name not in self.members:
+            self.members.update(self.loaders[name]())
+        return self.members[name]
+
+    def __iter__(self):
+        return (getattr(self, name) for name in StrategyResult.fields)
+
+    def __len__(self):
+        return len(StrategyResult.fields)
+
+    def __getitem__(self, index):
+        return tuple(self)[index] if isinstance(index, slice) else getattr(self, StrategyResult.fields[index])
+
+def simulated_members(acp_p, rebalance_p, weights_p, cash_weight_p, start_date_p):
+    pos, cash, pv = positions_pv(acp_p, rebalance_p, weights_p, cash_weight_p, start_date_p)
+    return {'pv' : pv, 'strat_rets' : pv / pv.shift(1) - 1, 'pos' : pos, 'cash' : cash}
+
+def weights_members(weights_p, cash_weight_p):
+    weights2 = weights_p.copy()
+    weights2['cash'] = cash_weight_p
+    return {'weights' : weights2, 'curr_weights' : weights2.iloc[-1]}
+
+def ew_members(acp_p, rebalance_p, start_date_p):
+    pos_ew, cash_ew, pv_ew = positions_pv_ew(acp_p, rebalance_p, start_date_p)
+    return {'pv_ew' : pv_ew, 'strat_rets_ew' : pv_ew / pv_ew.shift(1) - 1, 'pos_ew' : pos_ew, 'cash_ew' : cash_ew}
+
+def strategy_result(acp_p, rebalance_p, weights_p, cash_weight_p, start_date_p, ew_acp_p = None):
+    # The StrategyResult of the weights_p / cash_weight_p weighting of acp_p. ew_acp_p: the prices of the EW benchmark, acp_p if None.
+    ew_acp = acp_p if ew_acp_p is None else ew_acp_p
+    return StrategyResult([(('pv', 'strat_rets', 'pos', 'cash'), functools.partial(simulated_members, acp_p, rebalance_p, weights_p, cash_weight_p, start_date_p)),
+                           (('weights', 'curr_weights'), functools.partial(weights_members, weights_p, cash_weight_p)),
+                           (('pv_ew', 'strat_rets_ew', 'pos_ew', 'cash_ew'), functools.partial(ew_members, ew_acp, rebalance_p, start_date_p))])
+
+def rank_lookup(ranks_p, lookup_p, mask_p = None, fill_value_p = 0):
+    # Rank to weight (or leverage) mapping for any shape of ranks (days x strategies, days x ETFs, ...): rank r gets lookup_p[r-1].
+    # Where mask_p is False (e.g. the performance is under the absolute threshold, or the rank is missing) the result is fill_value_p.
+    ranks = np.asarray(ranks_p, dtype = float)
+    mask = np.isfinite(ranks) if mask_p is None else np.asarray(mask_p, dtype = bool) & np.isfinite(ranks)
+    rank_inds = np.where(mask, ranks, 1).astype(int) - 1
+    return np.where(mask, np.asarray(lookup_p, dtype = float)[rank_inds], fill_value_p)
+
+def rolling_comoments(rets_p, lb_p):
+    # Yields (row, N x N co-moment matrix sum((x - mean_x) * (y - mean_y)) of the lb_p rows window ending at row, valid ETFs of the window).
+    # The window mean and co-moments are updated as the window slides (Welford style add/remove), so the memory is N x N instead of the T x N x N
+    # of DataFrame.rolling().corr(). The add/remove leaves a rounding residual (~1e-20) where the window of an ETF becomes constant, so the constant
+    # windows are detected exactly (no change between the consecutive returns, like pandas) and their rows and columns are yielded as exact 0.
+    # Like pandas (min_periods = window) an ETF is only valid if it has no missing return in the window.
+    rets = np.asarray(rets_p, dtype = float)
+    no_rows, no_cols = rets.shape
+    is_valid = np.isfinite(rets)
+    rets0 = np.where(is_valid, rets, 0)
+    change_counts = np.concatenate((np.zeros((1, no_cols), dtype = int), np.cumsum(rets0[1:] != rets0[:-1], axis = 0)))
+    mean = np.zeros(no_cols)
+    comoments = np.zeros((no_cols, no_cols))
+    counts = np.zeros(no_cols)
+    for i in range(no_rows):
+        if i >= lb_p: # the oldest row leaves the window first
+            if lb_p == 1:
+                mean[:], comoments[:] = 0, 0
+            else:
+                delta = rets0[i - lb_p] - mean
+                mean -= delta / (lb_p - 1)
+                comoments -= np.outer(delta, rets0[i - lb_p] - mean)
+            counts -= is_valid[i - lb_p]
+        delta = rets0[i] - mean
+        mean += delta / min(i + 1, lb_p)
+        comoments += np.outer(delta, rets0[i] - mean)
+        counts += is_valid[i]
+        if i >= lb_p - 1 and (i + 1) % lb_p == 0: # exact recompute once per window length, the add/remove rounding errors don't accumulate
+            centered = rets0[i - lb_p + 1 : i + 1] - rets0[i - lb_p + 1 : i + 1].mean(axis = 0)
+            mean, comoments = rets0[i - lb_p + 1 : i + 1].mean(axis = 0), centered.T @ centered
+        if i >= lb_p - 1:
+            is_constant = change_counts[i] == change_counts[i - lb_p + 1]
+            if is_constant.any():
+                window_comoments = comoments.copy()
+                window_comoments[is_constant, :] = 0
+                window_comoments[:, is_constant] = 0
+                yield i, window_comoments, counts == lb_p
+            else:
+                yield i, comoments, counts == lb_p
+
+def rolling_avg_corr(dailyret_p, lb_p):
+    # Each ETF's average rolling correlation with all the valid ETFs (itself included) = dailyret_p.rolling(lb_p).corr() averaged by date, as a T x N frame.
+    no_rows, no_cols = dailyret_p.shape
+    avg_corr = np.full((no_rows, no_cols), np.nan)
+    for i, comoments, is_full in rolling_comoments(dailyret_p.to_numpy(dtype = float), lb_p):
+        is_full = is_full & (np.diag(comoments) > 0) # a constant price has no correlation (NaN in pandas, left out of the average)
+        if not is_full.any():
+            continue
+        inv_sd = np.zeros(no_cols)
+        inv_sd[is_full] = 1 / np.sqrt(np.diag(comoments)[is_full])
+        avg_corr[i, is_full] = (inv_sd @ comoments)[is_full] * inv_sd[is_full] / is_full.sum()
+    return pd.DataFrame(avg_corr, index = dailyret_p.index, columns = dailyret_p.columns)
+
+def hold_forward(values_p, mask_p, initial_p = 0, start_p = 0, lag_p = 0):
+    # Sample and hold: rows where mask_p is True take the row of values_p, the other rows hold the last taken value (initial_p before the first one).
+    # values_p: T x ... array, mask_p: boolean array with the leading dimensions of values_p (e.g. T for whole rows or T x N per cell).
+    # start_p: warm-up rows, the mask is ignored before this row. lag_p: the held values are used lag_p rows later (e.g. 1 for the day after the rebalance).
+    values = np.asarray(values_p, dtype = float)
+    mask = np.asarray(mask_p, dtype = bool).copy()
+    mask[:start_p] = False
+    mask = mask.reshape(mask.shape + (1,) * (values.ndim - mask.ndim))
+    rows = np.arange(values.shape[0]).reshape((-1,) + (1,) * (values.ndim - 1))
+    last_rows = np.broadcast_to(np.maximum.accumulate(np.where(mask, rows, -1), axis = 0), values.shape)
+    held = np.where(last_rows >= 0, np.take_along_axis(values, np.maximum(last_rows, 0), axis = 0), initial_p)
+    if lag_p > 0:
+        held = np.concatenate((np.full((lag_p,) + values.shape[1:], initial_p, dtype = float), held[:-lag_p]))
+    return held
+
+def expanding_month_stats(dates_p, values_p):
+    # Month of year statistics of a daily series cumulated over the years: [i, j] uses the values of month j+1 in the years <= years[i] (NaN values skipped).
+    # One pass over the days fills the (year, month) count / sum / sum of squares tables, the cumulative sums over the years give the expanding statistics.
+    dates = pd.DatetimeIndex(dates_p)
+    values = np.asarray(values_p, dtype = float)
+    date_years, date_months = dates.year.to_numpy(), dates.month.to_numpy()
+    years = np.unique(date_years)
+    valid = ~np.isnan(values)
+    year_idx, month_idx, values = np.searchsorted(years, date_years[valid]), date_months[valid] - 1, values[valid]
+    shift = np.zeros(12) # the variance sums are taken around the overall month mean, the sum of squares doesn't lose precision
+    np.divide(np.bincount(month_idx, values, 12), np.bincount(month_idx, None, 12), out = shift, where = np.bincount(month_idx, None, 12) > 0)
+    centered = values - shift[month_idx]
+    cell = year_idx * 12 + month_idx
+    count, sum_v, sum_c, sum_sq_c = [np.bincount(cell, w, len(years) * 12).reshape(len(years), 12).cumsum(axis = 0) for w in [None, values, centered, centered ** 2]]
+    cell_min, cell_max = np.full(len(years) * 12, np.inf), np.full(len(years) * 12, -np.inf)
+    np.minimum.at(cell_min, cell, values)
+    np.maximum.at(cell_max, cell, values)
+    constant = np.minimum.accumulate(cell_min.reshape(len(years), 12), axis = 0) == np.maximum.accumulate(cell_max.reshape(len(years), 12), axis = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = np.where(count > 0, sum_v / count, np.nan)
+        var = np.where(count > 1, np.maximum(sum_sq_c - sum_c ** 2 / count, 0) / (count - 1), np.nan)
+    std = np.where(constant & (count > 1), 0, np.sqrt(var)) # exactly 0 for a constant month, like the two pass std
+    return {'years' : years, 'count' : count, 'mean' : mean, 'std' : std}
+
+def regime_blend(regime_weights_p, regime_blocks_p, layout_p = 'concat'):
+    # Weights of a regime switching strategy: the weight block of each regime (DataFrames on the same index) times the daily weight of the regime.
+    # regime_weights_p: T x R, e.g. 1 for the active regime and 0 for the others, or a partial canary signal and its complement. A regime with 0 weight adds 0, even where its block is NaN.
+    # layout_p 'concat': the blocks side by side like pd.concat (a ticker of several blocks has a column in each), 'union': one column per ticker (sorted), the blocks added up.
+    regime_weights = np.asarray(regime_weights_p, dtype = float)
+    blended = [np.where(regime_weights[:, [r]] != 0, regime_weights[:, [r]] * block.to_numpy(dtype = float), 0) for r, block in enumerate(regime_blocks_p)]
+    index = regime_blocks_p[0].index
+    if layout_p == 'concat':
+        return pd.DataFrame(np.hstack(blended), index = index, columns = [column for block in regime_blocks_p for column in block.columns])
+    elif layout_p == 'union':
+        union_columns = sorted(set(column for block in regime_blocks_p for column in block.columns))
+        column_pos = {column : pos for pos, column in enumerate(union_columns)}
+        union_blended = np.zeros((len(index), len(union_columns)))
+        for block, block_blended in zip(regime_blocks_p, blended):
+            union_blended[:, [column_pos[column] for column in block.columns]] += block_blended
+        return pd.DataFrame(union_blended, index = index, columns = union_columns)
+    raise ValueError(f"SqError. Unknown regime blend layout: '{layout_p}'. Use 'concat' or 'union'.")
@@ -0,0 +1,74 @@
+# Trading calendar service of the MetaStrategy libs: the rebalance days of a date index and the next NYSE trading day.
+# The rebalance calendar is the same for every strategy with the same dates and rebalance parameters, it is calculated once and cached.
+# The arrays are read-only, they are shared by all the callers.
+
+import hashlib
+import functools
+import datetime as dt
+import pandas as pd
+import numpy as np
+
+max_cached_calendars = 64
+calendar_cache = {}
+calendar_cache_stats = {'hits' : 0, 'misses' : 0}
+
+def date_index_key(date_index_p):
+    # collision resistant identity of the dates (blake2b, not the 64 bit hash()), the cached calendars and features of other dates are never returned
+    date_values = np.ascontiguousarray(pd.DatetimeIndex(date_index_p).asi8)
+    return (len(date_values), hashlib.blake2b(memoryview(date_values), digest_size = 16).digest())
+
+def build_rebalance_calendar(date_index_p, rebalance_unit_p, rebalance_freq_p, rebalance_shift_p):
+    dates = pd.DatetimeIndex(date_index_p)
+    no_rows = len(dates)
+    year, month, week = dates.year.to_numpy(), dates.month.to_numpy(), dates.isocalendar().week.to_numpy(dtype = int)
+    # the last day of a month / week. The last row has no next day: it is a month end, but not a week end (the pandas week numbers
+    # are nullable integers, their comparison with the missing next week was NA and became False), kept for the same rebalance days.
+    unit_end = {'Month' : month, 'Week' : week}.get(rebalance_unit_p)
+    rebalance_unit = np.ones(no_rows, dtype = bool) if unit_end is None else np.append(unit_end[1:] != unit_end[:-1], rebalance_unit_p == 'Month')
+    shifted_unit = np.zeros(no_rows, dtype = bool)
+    if rebalance_shift_p >= 0:
+        shifted_unit[rebalance_shift_p:] = rebalance_unit[:max(no_rows - rebalance_shift_p, 0)]
+    else:
+        shifted_unit[:rebalance_shift_p] = rebalance_unit[-rebalance_shift_p:]
+    shifted_unit[:1] = True
+    no_period = np.concatenate(([0], np.cumsum(shifted_unit)[:-1])) if no_rows > 0 else np.zeros(0, dtype = int)
+    calendar = {'year' : year, 'month' : month, 'week' : week, 'rebalance_unit' : shifted_unit, 'no_period' : no_period, 'rebalance' : shifted_unit & (no_period % rebalance_freq_p == 0)}
+    for values in calendar.values():
+        values.flags.writeable = False
+    return calendar
+
+def rebalance_calendar(date_index_p, rebalance_unit_p, rebalance_freq_p, rebalance_shift_p):
+    # {'year', 'month', 'week' : int arrays, 'rebalance_unit' : the (shifted) last days of the rebalance units, 'no_period' : number of units before the day, 'rebalance' : bool array}
+    # rebalance_unit_p: 'Month', 'Week' or anything else for daily units. The first day is always a rebalance day.
+    key = (date_index_key(date_index_p), rebalance_unit_p, rebalance_freq_p, rebalance_shift_p)
+    if key in calendar_cache:
+        calendar_cache_stats['hits'] += 1
+        return calendar_cache[key]
+    calendar_cache_stats['misses'] += 1
+    calendar = build_rebalance_calendar(date_index_p, rebalance_unit_p, rebalance_freq_p, rebalance_shift_p)
+    if len(calendar_cache) >= max_cached_calendars:
+        del calendar_cache[next(iter(calendar_cache))] # the oldest one
+    calendar_cache[key] = calendar
+    return calendar
+
+def rebalance_days(date_index_p, rebalance_unit_p, rebalance_freq_p, rebalance_shift_p):
+    return rebalance_calendar(date_index_p, rebalance_unit_p, rebalance_freq_p, rebalance_shift_p)['rebalance']
+
+@functools.lru_cache(maxsize = None)
+def nyse_calendar():
+    import pandas_market_calendars as mcal # only the live mode needs the NYSE calendar
+    return mcal.get_calendar('NYSE')
+
+@functools.lru_cache(maxsize = 256)
+def next_trading_day(date_p):
+    # The first NYSE trading day after the day of date_p (a date or Timestamp, New York time).
+    last_day = pd.Timestamp(date_p).tz_localize('America/New_York').tz_convert('UTC')
+    upcom_trading_days = nyse_calendar().valid_days(start_date = last_day, end_date = last_day + dt.timedelta(days = 10))
+    return upcom_trading_days[1]
+
+@functools.lru_cache(maxsize = 256)
+def last_trading_day_before(date_p):
+    # The last NYSE trading day before the day of date_p (exclusive like the end of yf.download()), as a naive date Timestamp.
+    last_day = pd.Timestamp(date_p).normalize() - dt.timedelta(days = 1)
+    past_trading_days = nyse_calendar().valid_days(start_date = last_day - dt.timedelta(days = 10), end_date = last_day)
+    return past_trading_days[-1].tz_convert(None).normalize()
@@ -0,0 +1,86 @@
+# In-process feature store of the MetaStrategy libs: returns, momentum and rolling statistics of the price (or PV) columns, shared by all the strategies of a run.
+# A feature column is cached by (feature, window, shift, ddof, dtype) and the identity of the column's values, so a column is only reused for exactly the same
+# values (an other date range or a restated price is a new entry). The features only depend on the order of the values, not on the dates.
+# The columns of a PanelPriceProvider frame are identified by the digest the panel calculated once (cps.panel_column_key) and their rows, the other columns
+# by the blake2b digest of their values. The features are calculated per column, like pandas does, the cached values are equal to the direct calculation.
+# The least recently used columns are evicted above the memory budget. The features of a compact (float32) price panel are calculated in float64 and
+# cached and returned as float32.
+
+import threading
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import common_aa_pv as com
+import common_price_store as cps
+
+# feature(prices, window, ddof) on a price DataFrame, the value of a day uses the prices up to that day
+feature_funcs = {
+    'ret' : lambda prices, window, ddof: prices / prices.shift(window) - 1, # window day return, 'ret' with window 1 is the daily return
+    'mean' : lambda prices, window, ddof: (prices / prices.shift(1) - 1).rolling(window).mean(), # rolling mean of the daily returns
+    'std' : lambda prices, window, ddof: (prices / prices.shift(1) - 1).rolling(window).std(ddof), # rolling std of the daily returns
+    'neg_std' : lambda prices, window, ddof: (prices / prices.shift(1) - 1).pipe(lambda rets: rets.where(rets < 0, 0)).rolling(window).std(ddof), # rolling std of the negative daily returns (0 otherwise, Sortino)
+}
+
+def column_key(values_p):
+    # identity of the values of a price column: the panel digest and rows of a PanelPriceProvider column, else the blake2b digest of the values
+    panel_key = cps.panel_column_key(values_p)
+    return ('panel',) + panel_key if panel_key is not None else ('values', values_p.dtype.str, cps.column_digest(np.ascontiguousarray(values_p)))
+
+class FeatureStore:
+    def __init__(self, max_bytes = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.columns = OrderedDict() # key : read-only feature column, in least recently used order
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # the substrategies can run in threads
+
+    def feature(self, prices_p, feature_p, window_p = 1, shift_p = 0, ddof_p = 1):
+        # DataFrame of the feature with the index and columns of prices_p. shift_p: the value of a day is the feature shift_p days earlier.
+        if feature_p not in feature_funcs:
+            raise ValueError(f"SqError. Unknown feature: '{feature_p}'. Use one of {list(feature_funcs)}.")
+        value_dtype = com.value_dtype(prices_p)
+        column_values = [column.to_numpy() for _, column in prices_p.items()] # views of the columns (of the panel columns for a panel frame)
+        keys = [(feature_p, window_p, shift_p, ddof_p, np.dtype(value_dtype).str, column_key(values)) for values in column_values]
+        with self.lock:
+            found = [self.get(key) for key in keys]
+        missing_pos = [pos for pos, values in enumerate(found) if values is None]
+        if len(missing_pos) > 0:
+            missing_prices = pd.DataFrame(np.column_stack([column_values[pos].astype(float) for pos in missing_pos]), index = prices_p.index)
+            missing_values = feature_funcs[feature_p](missing_prices, window_p, ddof_p).shift(shift_p).to_numpy(dtype = float)
+            with self.lock:
+                for no_missing, pos in enumerate(missing_pos):
+                    found[pos] = self.put(keys[pos], missing_values[:, no_missing].astype(value_dtype))
+        feature_values = np.column_stack(found) if len(found) > 0 else np.zeros((len(prices_p.index), 0), dtype = value_dtype)
+        return pd.DataFrame(feature_values, index = prices_p.index, columns = prices_p.columns)
+
+    def get(self, key):
+        values = self.columns.get(key)
+        if values is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.columns.move_to_end(key)
+        return values
+
+    def put(self, key, values):
+        values.flags.writeable = False
+        if key not in self.columns:
+            self.nbytes += values.nbytes
+        self.columns[key] = values
+        while self.nbytes > self.max_bytes and len(self.columns) > 1:
+            old_key, old_values = self.columns.popitem(last = False)
+            self.nbytes -= old_values.nbytes
+        return values
+
+    def clear(self):
+        with self.lock:
+            self.columns.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits' : self.hits, 'misses' : self.misses, 'columns' : len(self.columns), 'bytes' : self.nbytes, 'max_bytes' : self.max_bytes}
+
+default_store = FeatureStore()
@@ -1,8 +1,6 @@
 import pandas as pd
 import numpy as np
 import math
-import plotly.express as px
-import plotly.graph_objects as go
 
 def total_return(pvs_p):
     tot_ret = pvs_p.iloc[-1] / pvs_p.iloc[0] -1
@@ -61,14 +59,12 @@ def mar_ratio(pvs_p):
     return mar
 
 def performance_indicators(pvs_p):
-    
-    tot_ret = total_return(pvs_p)
-    cagrs = cagr(pvs_p)
-    annual_mr = annual_mean_ret(pvs_p)
-    annual_sd = annual_stand_dev(pvs_p)
-    sharpe = sharpe_ratio(pvs_p)
-    mdd, dds = max_drawdown(pvs_p)
-    mar = mar_ratio(pvs_p)
+    import plotly.express as px # plotting only, the metrics engine below does not need plotly
+
+    metrics = perf_metrics(pvs_p).iloc[0]
+    tot_ret, cagrs, annual_mr, annual_sd = metrics['TotalRet'], metrics['CAGR'], metrics['AnnMeanRet'], metrics['AnnVol']
+    sharpe, mdd, mar = metrics['Sharpe'], metrics['MDD'], metrics['MAR']
+    dds = 1 - pvs_p / pvs_p.cummax()
 
     uws = 1 - dds
 
@@ -89,4 +85,72 @@ def performance_indicators(pvs_p):
     fig2 = px.line(uws, x=uws.index, y=uws.values, title='Underwater Plot')
     fig2.show()
 
-    return
\ No newline at end of file
+    return
+
+# Metrics engine: the indicators of many PVs (strategies, sweep combinations) as the columns of one PV matrix. The daily returns and drawdowns
+# are calculated once for all the columns, nothing is printed or plotted. Sharpe and Sortino are annualized like above, the Sortino deviation
+# is the standard deviation of the negative daily returns (the positive ones count as 0), like in meta(). MAR is NaN without a drawdown.
+perf_metric_names = ['TotalRet', 'CAGR', 'AnnMeanRet', 'AnnVol', 'Sharpe', 'Sortino', 'MDD', 'MAR']
+
+def pv_matrix(pvs_p):
+    return pvs_p.to_frame() if isinstance(pvs_p, pd.Series) else pvs_p
+
+def metrics_frame(tot_ret, cagrs, rets_mean, rets_sd, neg_rets_sd, mdd):
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return {'TotalRet' : tot_ret, 'CAGR' : cagrs, 'AnnMeanRet' : rets_mean * 252, 'AnnVol' : rets_sd * np.sqrt(252), 'Sharpe' : rets_mean / rets_sd * np.sqrt(252),
+                'Sortino' : rets_mean / neg_rets_sd * np.sqrt(252), 'MDD' : mdd, 'MAR' : np.where(mdd > 0, cagrs / np.where(mdd > 0, mdd, 1), np.nan)}
+
+def perf_metrics(pvs_p):
+    # One row per PV column with the perf_metric_names columns. A column is measured from its first to its last valid PV (sweep PVs can start later).
+    pvs = pv_matrix(pvs_p)
+    values = pvs.to_numpy(dtype = float)
+    no_rows, no_cols = values.shape
+    valid = np.isfinite(values)
+    first, last = valid.argmax(axis = 0), no_rows - 1 - valid[::-1].argmax(axis = 0)
+    cols = np.arange(no_cols)
+    no_years = (pvs.index[last] - pvs.index[first]) / np.timedelta64(1, 'D') / 365.25
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        tot_ret = values[last, cols] / values[first, cols] - 1
+        cagrs = (1 + tot_ret) ** (1 / np.asarray(no_years, dtype = float)) - 1
+        rets = values[1:] / values[:-1] - 1
+    neg_rets = np.where(rets < 0, rets, np.where(np.isnan(rets), np.nan, 0))
+    rets_count = np.isfinite(rets).sum(axis = 0)
+    rets_mean = np.nansum(rets, axis = 0) / rets_count
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        rets_sd = np.sqrt(np.nansum((rets - rets_mean) ** 2, axis = 0) / (rets_count - 1))
+        neg_rets_sd = np.sqrt(np.nansum((neg_rets - np.nansum(neg_rets, axis = 0) / rets_count) ** 2, axis = 0) / (rets_count - 1))
+        mdd = np.fmax.reduce(1 - values / np.fmax.accumulate(values, axis = 0), axis = 0)
+    return pd.DataFrame(metrics_frame(tot_ret, cagrs, rets_mean, rets_sd, neg_rets_sd, mdd), index = pvs.columns, columns = perf_metric_names)
+
+def rolling_max_drawdown(values_p, window_p, chunk_p = 256):
+    # Max drawdown inside the trailing window_p + 1 PVs of each day (NaN before the first full window). The windows are strided views,
+    # they are evaluated chunk_p days at a time, so the memory is chunk_p x window_p per column.
+    mdd = np.full(values_p.shape, np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(values_p, window_p + 1, axis = 0) # (days, columns, window)
+    for start in range(0, len(windows), chunk_p):
+        chunk = windows[start:start + chunk_p]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            mdd[window_p + start:window_p + start + len(chunk)] = np.fmax.reduce(1 - chunk / np.fmax.accumulate(chunk, axis = 2), axis = 2)
+    return mdd
+
+def rolling_perf_metrics(pvs_p, window_p = 252):
+    # The metrics of the trailing window_p days (window_p daily returns) ending at each day, all the columns in one pass.
+    # Tidy table: one row per (date, strategy) with the perf_metric_names columns, the days before the first full window are left out.
+    pvs = pv_matrix(pvs_p)
+    values = pvs.to_numpy(dtype = float)
+    no_rows, no_cols = values.shape
+    if no_rows <= window_p:
+        return pd.DataFrame(columns = perf_metric_names, index = pd.MultiIndex.from_arrays([[], []], names = ['date', 'strategy']))
+    rets = pd.DataFrame(values, index = pvs.index).pct_change(fill_method = None)
+    neg_rets = rets.where((rets < 0) | rets.isna(), 0)
+    rets_mean, rets_sd = rets.rolling(window_p).mean().to_numpy(), rets.rolling(window_p).std().to_numpy()
+    neg_rets_sd = neg_rets.rolling(window_p).std().to_numpy()
+    tot_ret = np.full(values.shape, np.nan)
+    tot_ret[window_p:] = values[window_p:] / values[:-window_p] - 1
+    no_years = np.full((no_rows, 1), np.nan)
+    no_years[window_p:, 0] = (pvs.index[window_p:] - pvs.index[:-window_p]) / np.timedelta64(1, 'D') / 365.25
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        cagrs = (1 + tot_ret) ** (1 / no_years) - 1
+    metrics = metrics_frame(tot_ret, cagrs, rets_mean, rets_sd, neg_rets_sd, rolling_max_drawdown(values, window_p))
+    index = pd.MultiIndex.from_product([pvs.index[window_p:], pvs.columns], names = ['date', 'strategy'])
+    return pd.DataFrame({name : np.asarray(metric)[window_p:].reshape(-1) for name, metric in metrics.items()}, index = index, columns = perf_metric_names)
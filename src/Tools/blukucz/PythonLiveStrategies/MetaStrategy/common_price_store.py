@@ -0,0 +1,203 @@
+# Local adjusted close price store for the MetaStrategy libs.
+# One .npy file per ticker (date as day number, adjusted close) and an _index.json that keeps the stored date range of each ticker.
+# Only the missing days are downloaded from YF: the trailing days since the last stored day, or the older days if an earlier start is requested.
+# Offline mode (backtests) never downloads, it serves what is already in the store.
+
+import os
+import json
+import hashlib
+import weakref
+import datetime as dt
+import pandas as pd
+import numpy as np
+import common_calendar as ccal
+
+store_dir = os.environ.get('SQ_PRICE_STORE_DIR', os.path.join(os.path.expanduser('~'), 'SqCoreData', 'MetaStrategyPriceStore'))
+offline = os.environ.get('SQ_PRICE_STORE_OFFLINE', '0') == '1'
+overlap_days = 10 # calendar days downloaded again before the last stored day, to check that the earlier adjusted prices are unchanged
+adj_change_tolerance = 1e-6 # relative change in the overlap prices that means a new dividend/split adjustment, the whole history is downloaded again
+
+def column_digest(values_p):
+    # collision resistant identity of the values of a contiguous price column (blake2b, not the 64 bit hash())
+    return hashlib.blake2b(memoryview(values_p), digest_size = 16).digest()
+
+panel_columns = {} # id of a read-only PanelPriceProvider column : (weak reference to the column, digest of the column)
+
+def register_panel_column(column_p, digest_p):
+    column_id = id(column_p)
+    panel_columns[column_id] = (weakref.ref(column_p, lambda ref: panel_columns.pop(column_id, None)), digest_p)
+
+def panel_column_key(values_p):
+    # (digest of the panel column, first row, number of rows) if values_p is a read-only view of the rows of a PanelPriceProvider column, else None.
+    # The feature store identifies the price columns of a panel by it, the digest of a panel column is only calculated once.
+    owner = values_p if values_p.base is None else values_p.base
+    entry = panel_columns.get(id(owner))
+    if entry is None or entry[0]() is not owner or values_p.flags.writeable or values_p.ndim != 1 or values_p.dtype != owner.dtype or (len(values_p) > 1 and values_p.strides[0] != owner.itemsize):
+        return None
+    first_row = (values_p.__array_interface__['data'][0] - owner.__array_interface__['data'][0]) // owner.itemsize
+    return (entry[1], first_row, len(values_p))
+
+def yf_adj_close(ticker_list, start, end):
+    import yfinance as yf # imported on the first download only, the offline and the store-served runs never load it
+    # 2025-02-27: yf API changed. The default auto_adjust=True gives only adjusted OHLC, not giving AdjClose, so impossible to reverse engineer the splits, dividindends and rawPrices. The auto_adjust=false gives OHLC (raw) + 'Adj Close'.
+    adj_close_price = yf.download(ticker_list, start = start, end = end, auto_adjust=False)['Adj Close']
+    if isinstance(adj_close_price, pd.Series): # older yf versions return a Series for a single ticker
+        adj_close_price = adj_close_price.to_frame(ticker_list[0])
+    return adj_close_price
+
+def read_index():
+    index_path = os.path.join(store_dir, '_index.json')
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+def write_index(store_index):
+    os.makedirs(store_dir, exist_ok = True)
+    tmp_path = os.path.join(store_dir, '_index.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(store_index, f, indent = 1, sort_keys = True)
+    os.replace(tmp_path, os.path.join(store_dir, '_index.json'))
+
+def read_ticker(ticker):
+    ticker_path = os.path.join(store_dir, ticker + '.npy')
+    if not os.path.exists(ticker_path):
+        return pd.Series(dtype = float, index = pd.DatetimeIndex([]), name = ticker)
+    data = np.load(ticker_path)
+    dates = pd.DatetimeIndex(data['date'].astype('datetime64[D]').astype('datetime64[ns]'))
+    return pd.Series(data['adj_close'], index = dates, name = ticker)
+
+def write_ticker(ticker, prices):
+    os.makedirs(store_dir, exist_ok = True)
+    data = np.empty(len(prices), dtype = [('date', 'i8'), ('adj_close', 'f8')])
+    data['date'] = prices.index.values.astype('datetime64[D]').astype('i8')
+    data['adj_close'] = prices.to_numpy(dtype = float)
+    tmp_path = os.path.join(store_dir, ticker + '.tmp.npy')
+    np.save(tmp_path, data)
+    os.replace(tmp_path, os.path.join(store_dir, ticker + '.npy'))
+
+def download_groups(fetch_starts, end):
+    # one YF request per distinct start date, all tickers of the same start date are downloaded together
+    downloaded = {}
+    for start in sorted(set(fetch_starts.values())):
+        group = sorted(ticker for ticker, ticker_start in fetch_starts.items() if ticker_start == start)
+        adj_close_price = yf_adj_close(group, start, end)
+        for ticker in group:
+            downloaded[ticker] = adj_close_price[ticker].dropna() if ticker in adj_close_price.columns else pd.Series(dtype = float, index = pd.DatetimeIndex([]))
+    return downloaded
+
+def checked_until(new_prices, end_str, today_str):
+    # End (exclusive) of the date range the download is known to cover: min(end, today) if the prices reach the last NYSE trading day before it,
+    # otherwise only the days up to the last downloaded price (a stale download is not taken as a check of the missing days).
+    until_str = min(end_str, today_str)
+    if new_prices.index.max() >= ccal.last_trading_day_before(until_str):
+        return until_str
+    return (new_prices.index.max() + pd.DateOffset(days = 1)).strftime('%Y-%m-%d')
+
+def update(ticker_list, start, end):
+    # Download the missing date ranges of the tickers into the store. end is exclusive like in yf.download().
+    store_index = read_index()
+    start_str, end_str = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    today_str = dt.date.today().strftime('%Y-%m-%d')
+    full_starts, tail_starts = {}, {}
+    for ticker in ticker_list:
+        info = store_index.get(ticker)
+        if info is None or start_str < info['first_requested']:
+            full_starts[ticker] = start_str
+        elif end_str > info['checked_until']:
+            last_date = pd.to_datetime(info['last_date']) if info['last_date'] is not None else start
+            tail_starts[ticker] = (last_date - pd.DateOffset(days = overlap_days)).strftime('%Y-%m-%d')
+
+    downloaded_tails = download_groups(tail_starts, end_str)
+    for ticker, new_prices in downloaded_tails.items():
+        if len(new_prices) == 0:
+            continue # empty or failed download, the stored prices stay and checked_until is not advanced
+        stored = read_ticker(ticker)
+        # the last stored day can be an intraday price, it is only replaced, not checked
+        overlap = stored.index[:-1].intersection(new_prices.index)
+        if len(overlap) > 0 and np.abs(new_prices[overlap] / stored[overlap] - 1).max() > adj_change_tolerance:
+            full_starts[ticker] = store_index[ticker]['first_requested'] # a new dividend or split changed the adjusted history
+            continue
+        merged = pd.concat([stored[stored.index < new_prices.index.min()], new_prices])
+        write_ticker(ticker, merged)
+        store_index[ticker].update({'last_date' : merged.index.max().strftime('%Y-%m-%d'), 'checked_until' : max(store_index[ticker]['checked_until'], checked_until(new_prices, end_str, today_str))})
+
+    first_requested = {ticker : min(full_starts[ticker], store_index[ticker]['first_requested']) if ticker in store_index else full_starts[ticker] for ticker in full_starts}
+    downloaded_full = download_groups(first_requested, end_str)
+    for ticker, new_prices in downloaded_full.items():
+        if len(new_prices) == 0:
+            continue # empty or failed download, nothing is stored and the range is not marked as checked
+        write_ticker(ticker, new_prices)
+        store_index[ticker] = {'first_requested' : first_requested[ticker], 'last_date' : new_prices.index.max().strftime('%Y-%m-%d'), 'checked_until' : checked_until(new_prices, end_str, today_str)}
+
+    if len(tail_starts) > 0 or len(full_starts) > 0:
+        write_index(store_index)
+
+def adj_close(ticker_list, start, end):
+    # Drop-in replacement of yf.download(ticker_list, start, end, auto_adjust=False)['Adj Close'].
+    # Same shape as the YF result: sorted unique ticker columns, the dates where any of the tickers has a price, end date exclusive.
+    start, end = pd.to_datetime(start), pd.to_datetime(end)
+    tickers = sorted(set(ticker_list))
+    if offline:
+        # the stored range of a ticker has to cover [start, end) like in update(), the days after today can't have prices yet
+        store_index = read_index()
+        start_str, end_str = start.strftime('%Y-%m-%d'), min(end, pd.Timestamp(dt.date.today())).strftime('%Y-%m-%d')
+        missing = [ticker for ticker in tickers if ticker not in store_index or start_str < store_index[ticker]['first_requested'] or end_str > store_index[ticker]['checked_until']]
+        if len(missing) > 0:
+            raise ValueError(f'SqError. Price store is in offline mode and has no prices for {missing} in {store_dir} between {start_str} and {end_str}.')
+    else:
+        update(tickers, start, end)
+
+    adj_close_price = pd.concat([read_ticker(ticker) for ticker in tickers], axis = 1).reindex(columns = tickers)
+    adj_close_price = adj_close_price[(adj_close_price.index >= start) & (adj_close_price.index < end)].dropna(how = 'all')
+    adj_close_price.index.name = 'Date'
+    adj_close_price.columns.name = None
+    return adj_close_price
+
+class StorePriceProvider:
+    # Default price provider of the *_lib functions: every request is served from the local price store.
+    def adj_close(self, ticker_list, start, end):
+        return adj_close(ticker_list, start, end)
+
+class PanelPriceProvider:
+    # Serves the requests from one in-memory adjusted close panel: the union of all meta() tickers fetched in one request, or a local stand-in panel in tests.
+    # The returned frames are built on read-only views of the panel columns, so no prices are copied. The only exception is
+    # when some days have no price for any of the requested tickers, these days are dropped like YF does.
+    # dtype = np.float32 is the compact mode of the libs: only the panel columns, the cached features and the substrategy positions are float32,
+    # the weights, cash and PVs stay float64. These arrays take about half the memory (500 tickers x 30 years TAA: 146 -> 81 MB at the weights stage),
+    # the peak of the signal stage only drops about 20% (368 -> 304 MB), pandas calculates the rolling statistics in float64.
+    # It is not bit for bit with the float64 run: the PVs differ by the float32 price rounding (about 1e-6 relative), and the near-tied meta ranks
+    # can break the other way, then the rel_mom / sharpe / sortino based meta PVs differ by up to about 0.7%.
+    # panel_key identifies the panel (dtype, dates and the digests of the columns), it is calculated once, e.g. for the substrategy cache of the sweeps.
+    def __init__(self, adj_close_price, dtype = float):
+        adj_close_price = adj_close_price.sort_index(axis = 1)
+        self.index = adj_close_price.index
+        self.dtype = np.dtype(dtype)
+        self.columns = {}
+        self.column_digests = {}
+        for ticker in adj_close_price.columns:
+            column = np.array(adj_close_price[ticker].to_numpy(dtype = dtype), copy = True) # owns its values, the returned frames are views of it
+            column.flags.writeable = False
+            self.columns[ticker] = column
+            self.column_digests[ticker] = column_digest(column)
+            register_panel_column(column, self.column_digests[ticker])
+        self.panel_key = (self.dtype.str, ccal.date_index_key(self.index), tuple(self.column_digests.items()))
+
+    def adj_close(self, ticker_list, start, end):
+        tickers = sorted(set(ticker_list))
+        missing = [ticker for ticker in tickers if ticker not in self.columns]
+        if len(missing) > 0:
+            raise ValueError(f'SqError. The price panel has no prices for {missing}.')
+        first_row, end_row = self.index.searchsorted(pd.to_datetime(start)), self.index.searchsorted(pd.to_datetime(end))
+        adj_close_price = pd.DataFrame({ticker : self.columns[ticker][first_row:end_row] for ticker in tickers}, index = self.index[first_row:end_row], copy = False)
+        has_price = adj_close_price.notna().any(axis = 1)
+        if not has_price.all():
+            adj_close_price = adj_close_price[has_price]
+        return adj_close_price
+
+def shared_panel_provider(ticker_list, start, end, price_provider = None, dtype = float):
+    # One bulk request for the union of the tickers of all sub-strategies, they get column views of the shared panel.
+    price_provider = default_provider if price_provider is None else price_provider
+    return PanelPriceProvider(price_provider.adj_close(ticker_list, start, end), dtype)
+
+default_provider = StorePriceProvider()
@@ -0,0 +1,135 @@
+# Opt-in stage profiler of the MetaStrategy libs: wall time, peak memory and data shape of the named stages (download, signals, weights, pv, overlays)
+# of meta(), leveraged_meta() and the substrategies. A lib gets a timer by stage_timer(strategy) and marks the end of each stage by timer.lap(stage, data).
+# Without an active profiler stage_timer() returns a no-op timer, so the instrumentation costs one global lookup and an empty call per stage.
+# Usage: profiler = cprof.Profiler(log_path = 'profile.jsonl'); leveraged_meta(..., profiler = profiler); profiler.report()
+#        or with cprof.profiling(profiler): taa(...) for a substrategy alone.
+# peak_mb is the peak of the Python heap (tracemalloc) during the stage above the heap at the stage start. The substrategies of the 'thread' parallel mode
+# are profiled too, their memory peaks overlap. The ones of the 'process' mode run in other processes, only the meta 'substrats' stage covers them.
+
+import json
+import time
+import threading
+import functools
+import contextlib
+import tracemalloc
+import datetime as dt
+import pandas as pd
+
+active_profiler = None
+
+class NoStageTimer:
+    def lap(self, stage, data = None):
+        pass
+
+no_stage_timer = NoStageTimer()
+
+class StageTimer:
+    def __init__(self, profiler, strategy):
+        self.profiler = profiler
+        self.strategy = strategy
+        self.start = time.perf_counter()
+        self.start_memory = self.peak_memory = profiler.traced_memory()
+
+    def lap(self, stage, data = None):
+        self.profiler.lap(self, stage, data)
+
+def data_shape(data):
+    # (rows, columns) of a frame, array or a dict / list of them (max rows, sum of columns)
+    if data is None:
+        return None, None
+    if isinstance(data, dict):
+        data = list(data.values())
+    if isinstance(data, (list, tuple)):
+        shapes = [data_shape(item) for item in data]
+        return max((rows for rows, cols in shapes if rows is not None), default = None), sum(cols for rows, cols in shapes if cols is not None)
+    shape = getattr(data, 'shape', None)
+    if shape is None or len(shape) == 0:
+        return None, None
+    return shape[0], shape[1] if len(shape) > 1 else 1
+
+class Profiler:
+    def __init__(self, log_path = None, trace_memory = True):
+        # log_path: optional JSON-lines file, the records of every profiled call are appended to it. trace_memory: False skips the tracemalloc overhead.
+        self.log_path = log_path
+        self.trace_memory = trace_memory
+        self.records = []
+        self.open_timers = []
+        self.call = None
+        self.run_id = None
+        self.run_start = 0
+        self.lock = threading.Lock() # the substrategies can run in threads
+
+    def traced_memory(self):
+        return tracemalloc.get_traced_memory()[0] if self.trace_memory and tracemalloc.is_tracing() else 0
+
+    def timer(self, strategy):
+        timer = StageTimer(self, strategy)
+        with self.lock:
+            self.open_timers.append(timer)
+        return timer
+
+    def lap(self, timer, stage, data):
+        now = time.perf_counter()
+        rows, cols = data_shape(data)
+        with self.lock:
+            peak_mb = None
+            if self.trace_memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                for open_timer in self.open_timers: # the enclosing stages (e.g. meta 'substrats') keep the peaks of their inner stages
+                    open_timer.peak_memory = max(open_timer.peak_memory, peak)
+                tracemalloc.reset_peak()
+                peak_mb = (timer.peak_memory - timer.start_memory) / 2**20
+                timer.start_memory = timer.peak_memory = current
+            self.records.append({'run_id' : self.run_id, 'call' : self.call, 'strategy' : timer.strategy, 'stage' : stage, 'seconds' : now - timer.start, 'peak_mb' : peak_mb,
+                                 'rows' : rows, 'cols' : cols, 'thread' : threading.current_thread().name})
+        timer.start = time.perf_counter()
+
+    def begin(self, call):
+        self.call = call
+        self.run_id = dt.datetime.now().isoformat(timespec = 'milliseconds')
+        self.run_start = len(self.records)
+
+    def end(self):
+        self.open_timers = []
+        if self.log_path is not None:
+            with open(self.log_path, 'a') as log_file:
+                for record in self.records[self.run_start:]:
+                    log_file.write(json.dumps(record) + '\n')
+
+    def report(self):
+        # one row per stage of all the profiled calls, in the order of the stage ends
+        return pd.DataFrame(self.records, columns = ['run_id', 'call', 'strategy', 'stage', 'seconds', 'peak_mb', 'rows', 'cols', 'thread'])
+
+@contextlib.contextmanager
+def profiling(profiler, call = None):
+    # Makes profiler the active profiler of the libs. None or the already active profiler (meta() called by leveraged_meta()) keeps the current state.
+    global active_profiler
+    if profiler is None or profiler is active_profiler:
+        yield active_profiler
+        return
+    previous = active_profiler
+    started_tracing = profiler.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler.begin(call)
+    active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        active_profiler = previous
+        profiler.end()
+        if started_tracing:
+            tracemalloc.stop()
+
+def profiled(call):
+    # Decorator of the top level calls: adds the optional profiler keyword argument, the call runs in profiling(profiler).
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, profiler = None, **kwargs):
+            with profiling(profiler, call):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def stage_timer(strategy):
+    return no_stage_timer if active_profiler is None else active_profiler.timer(strategy)
@@ -14,21 +14,10 @@ warnings.filterwarnings('ignore')
 # Importing necessary libraries
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import yfinance as yf
-import pyfolio as pf
-import datetime as dt
-import pandas_datareader.data as web
-import os
 import common_aa_pv as com
-import pandas_market_calendars as mcal
-
-
-
-# print all outputs
-from IPython.core.interactiveshell import InteractiveShell
-InteractiveShell.ast_node_interactivity = "all"
-from scipy.stats import rankdata
+import common_calendar as ccal
+import common_feature_store as cfs
+import common_profiler as cprof
 from functools import reduce
 
 from taa_lib import taa
@@ -38,36 +27,18 @@ from meta_lib import meta
 from haa_lib import haa
 
 
-def weight_recalc(reb_df, cum_weights_p):
-    reb_day = reb_df.Rebalance.to_numpy()
-    cum_weights = cum_weights_p.to_numpy()
-    no_rows, no_cols = cum_weights_p.shape
-
-    new_weights = np.zeros((no_rows, no_cols))
-    for i in range(1, no_rows):
-        for j in range(no_cols):
-            if reb_day[i-1] == True:
-                new_weights[i, j] = cum_weights[i-1, j]
-            else:
-                new_weights[i, j] = new_weights[i-1, j]
-
+def weight_recalc(rebalance_p, cum_weights_p):
+    # the weights of the rebalance day are held from the next day until the day after the next rebalance
+    new_weights = com.hold_forward(cum_weights_p.to_numpy(), rebalance_p, 0, 0, 1)
     new_weights_df = pd.DataFrame(new_weights, index = cum_weights_p.index, columns = cum_weights_p.columns)
 
     return new_weights_df
 
-def lev_by_rank(rank_df, leverage_array, min_lb_years, reb_df):
-    rank_mx = rank_df.to_numpy()
-    no_rows, no_cols = rank_df.shape
+def lev_by_rank(rank_df, leverage_array, min_lb_years, rebalance_p):
+    # leverage 1 in the lookback warm-up, then the leverage of the rank on the rebalance days, held until the next rebalance
+    rank_leverages = com.rank_lookup(rank_df.to_numpy(), leverage_array)
     lb_days = min_lb_years*252
-    reb_day = reb_df.Rebalance.to_numpy()
-    rank_based_leverages = np.ones((no_rows, no_cols))
-
-    for no_days in range(lb_days, no_rows):
-        for etfs in range(no_cols):
-            if reb_day[no_days] == True:
-                rank_based_leverages[no_days, etfs] = leverage_array[rank_mx[no_days, etfs] - 1]
-            else:
-                rank_based_leverages[no_days, etfs] = rank_based_leverages[no_days - 1, etfs]
+    rank_based_leverages = com.hold_forward(rank_leverages, rebalance_p, 1, lb_days)
 
     rank_based_leverages_df = pd.DataFrame(rank_based_leverages, index = rank_df.index, columns = rank_df.columns)
 
@@ -76,56 +47,36 @@ def lev_by_rank(rank_df, leverage_array, min_lb_years, reb_df):
 def yearly_sharpe(pv_p):
     daily_profit_df = (pv_p.copy())
     daily_profit_df.columns = ['PV']
-    daily_profit_df['Year'], daily_profit_df['Month'] = daily_profit_df.index.year, daily_profit_df.index.month
     daily_profit_df['Profit'] = daily_profit_df.PV / daily_profit_df.PV.shift(1) - 1
-    
-    years_played = np.array(sorted(daily_profit_df.Year.unique()))
-    
-    no_years = len(years_played)
-    no_months = 12
 
-    avg_mtx = np.zeros((no_years, no_months))
-    std_mtx = np.zeros((no_years, no_months))
-    sharpe_mtx = np.zeros((no_years, no_months))
-
-    for i in range(no_years):
-        for j in range(no_months):
-            avg_mtx[i, j] = daily_profit_df.loc[(daily_profit_df['Year'] <= years_played[i]) & (daily_profit_df['Month'] == j+1), 'Profit'].mean() * 252
-            std_mtx[i, j] = daily_profit_df.loc[(daily_profit_df['Year'] <= years_played[i]) & (daily_profit_df['Month'] == j+1), 'Profit'].std() * np.sqrt(252)
-            sharpe_mtx[i, j] = avg_mtx[i, j] / std_mtx[i, j]
+    # Sharpe of each calendar month, using the days of that month in the current and all the previous years
+    month_stats = com.expanding_month_stats(daily_profit_df.index, daily_profit_df.Profit.to_numpy())
+    years_played = month_stats['years']
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        sharpe_mtx = (month_stats['mean'] * 252) / (month_stats['std'] * np.sqrt(252))
 
     sharpe_df = pd.DataFrame(sharpe_mtx, index = years_played)
     sharpe_df.columns += 1
     return sharpe_df
 
-def lev_by_monthly_perf(sharpe_rank, leverage_array, year_month_df, min_lb_years):
+def lev_by_monthly_perf(sharpe_rank, leverage_array, dates_p, min_lb_years):
     sharpe_rank_mtx = sharpe_rank.to_numpy()
-    no_years, no_months = sharpe_rank.shape
-    year_month_df_to_fill = year_month_df[['Year', 'Month']]
+    year_month_df_to_fill = pd.DataFrame({'Year' : dates_p.year, 'Month' : dates_p.month}, index = dates_p)
     lb_days = min_lb_years*252
-    last_day_ny = year_month_df.index[-1].tz_localize('America/New_York') 
-
-    last_day = last_day_ny.tz_convert('UTC')
-    nyse = mcal.get_calendar('NYSE')
-    upcom_trading_days = nyse.valid_days(start_date = last_day, end_date= last_day + dt.timedelta(days=10))
-    next_trading_day = upcom_trading_days[1]
+    next_trading_day = ccal.next_trading_day(dates_p[-1])
 
     ym_array_length = len(year_month_df_to_fill.index) + 1
     year_month_array = np.ones(ym_array_length)
 
-
-    monthly_leverages = np.ones((no_years, no_months))
-
-    for years_p in range(no_years):
-        for months_p in range(no_months):
-            if sharpe_rank_mtx[years_p, months_p] < 13:
-                monthly_leverages[years_p, months_p] = leverage_array[sharpe_rank_mtx[years_p, months_p] - 1]
+    monthly_leverages = com.rank_lookup(sharpe_rank_mtx, leverage_array, sharpe_rank_mtx < 13, 1)
 
     monthly_leverages_df = pd.DataFrame(monthly_leverages, index = sharpe_rank.index, columns = sharpe_rank.columns)
 
-    for days in range(lb_days, ym_array_length - 1):
-        if year_month_df_to_fill.Year[days] > monthly_leverages_df.index[0]:
-            year_month_array[days] = monthly_leverages_df.loc[year_month_df_to_fill.Year[days] - 1, year_month_df_to_fill.Month[days]]
+    # the leverage of a day is the (previous year, month) leverage, the days of the first year and of the lookback warm-up keep 1
+    days = np.arange(lb_days, ym_array_length - 1)
+    day_years, day_months = year_month_df_to_fill.Year.to_numpy()[days], year_month_df_to_fill.Month.to_numpy()[days]
+    has_prev_year = day_years > monthly_leverages_df.index[0]
+    year_month_array[days[has_prev_year]] = monthly_leverages[np.searchsorted(monthly_leverages_df.index, day_years[has_prev_year] - 1), day_months[has_prev_year] - 1]
 
     next_trading_day_monthly_lev = monthly_leverages_df.loc[next_trading_day.year - 1, next_trading_day.month]
     year_month_array[-1] = next_trading_day_monthly_lev
@@ -140,7 +91,7 @@ def lev_by_tip_perf(p_tipPrices, p_tipBasedETFLeverage):
     rolling_returns = pd.DataFrame()
     
     for period in rolling_periods:
-        rolling_returns[f'{period}_day'] = (p_tipPrices / p_tipPrices.shift(period) - 1)
+        rolling_returns[f'{period}_day'] = cfs.default_store.feature(p_tipPrices, 'ret', period)
 
     # Calculate the average of 4-period returns
     avg_4_period_returns = rolling_returns.mean(axis=1)
@@ -152,23 +103,56 @@ def lev_by_tip_perf(p_tipPrices, p_tipBasedETFLeverage):
     df = pd.DataFrame(index=quintiles.index)
 
     for etf, leverage_values in p_tipBasedETFLeverage.items():
-        leverages = []
-        for quintile in quintiles:
-            if pd.isna(quintile):
-                leverages.append(1)
-            else:
-                leverages.append(leverage_values[int(quintile) - 1])
-        df[etf] = leverages
+        df[etf] = com.rank_lookup(quintiles.to_numpy(), leverage_values, None, 1) # no quintile (not enough history): leverage 1
 
     return df, quintiles.iloc[-1]
 
-def leveraged_meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, meta_leverage_parameters, haa_parameters):
-    pv_dct, rets_dct, weights_dct, pos_dct, cash_dct, curr_substrats_weights_dct, curr_ETF_weights_dct, adj_close_price, cum_ETF_weigths_dict = meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, haa_parameters)
+def tlt_regime_leverage(tlt_prices_p, tlt_based_leverage_p, start_date_p):
+    # TLT 1 and 3 month momentum regimes (+, +), (+, -), (-, +) and the rest (also without enough history) get the leverages tlt_based_leverage_p[0..3]
+    tlt = tlt_prices_p.iloc[:, 0]
+    one_m, three_m = cfs.default_store.feature(tlt_prices_p, 'ret', 21).iloc[:, 0], cfs.default_store.feature(tlt_prices_p, 'ret', 63).iloc[:, 0]
+    regime = np.select([(one_m >= 0) & (three_m >= 0), (one_m >= 0) & (three_m < 0), (one_m < 0) & (three_m >= 0)], [0, 1, 2], 3)
+    tlt_leverage = pd.Series(np.asarray(tlt_based_leverage_p, dtype = float)[regime], index = tlt.index, name = 'TLTLev')
+    return tlt_leverage[tlt_leverage.index >= start_date_p]
+
+# Leverage overlays on top of the per ETF rank based leverages. A builder gets the overlay context (the meta PV, the dates and rebalance days, the prices and the leverage parameters)
+# and returns a scalar, a daily leverage Series (same for all the ETFs) or a per ETF leverage DataFrame. A builder can leave extra results in the context.
+def overall_leverage_overlay(context):
+    return context['meta_leverage_parameters']['meta_overall_leverage']
+
+def monthly_seasonality_overlay(context):
+    sharpe_by_years_rank = yearly_sharpe(context['used_pv']).rank(axis = 1, ascending = False).fillna(99).astype(int)
+    leverage_parameters = context['meta_leverage_parameters']
+    return lev_by_monthly_perf(sharpe_by_years_rank, leverage_parameters['meta_monthly_seas_based_leverage'], context['dates'], leverage_parameters['meta_leverage_lookback_years']).MonthlyLev
+
+def tlt_regime_overlay(context):
+    return tlt_regime_leverage(context['tlt_prices'], context['meta_leverage_parameters']['meta_tlt_based_leverage'], context['used_pv'].index[0])
+
+def tip_quintile_overlay(context):
+    tip_leverages, context['curr_tip_quint'] = lev_by_tip_perf(context['tip_prices'], context['meta_leverage_parameters']['meta_tip_based_leverage'])
+    return tip_leverages.loc[context['dates']]
+
+default_leverage_overlays = {'overall' : overall_leverage_overlay, 'monthly_seasonality' : monthly_seasonality_overlay, 'tlt_regime' : tlt_regime_overlay, 'tip_quintile' : tip_quintile_overlay}
+
+def apply_leverage_overlays(base_leverage_p, overlays_p):
+    # The base leverages multiplied by the overlays in order (pandas alignment: a Series by the dates, a DataFrame by the dates and the ETFs)
+    final_leverage = base_leverage_p
+    for overlay in overlays_p.values():
+        final_leverage = final_leverage.multiply(overlay, axis = 'index') if isinstance(overlay, (pd.Series, pd.DataFrame)) else final_leverage * overlay
+    return final_leverage
+
+@cprof.profiled('leveraged_meta') # leveraged_meta(..., profiler = cprof.Profiler()) records the stages of the call, the meta() ones too
+def leveraged_meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, meta_leverage_parameters, haa_parameters, price_provider = None, substrat_cache = None, overlay_builders = None, overlay_contributions = None):
+    pv_dct, rets_dct, weights_dct, pos_dct, cash_dct, curr_substrats_weights_dct, curr_ETF_weights_dct, adj_close_price, cum_ETF_weigths_dict = meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, haa_parameters, price_provider, substrat_cache)
     used_substrat_weights = meta_parameters['used_substrat_weights']
-    used_substrat_pv = pv_dct[used_substrat_weights]
-    used_substrat_cum_ETF_weights = cum_ETF_weigths_dict[used_substrat_weights]
-    pv_df = pd.DataFrame(used_substrat_pv, index = pv_dct['ew_based'].index)
-    cum_ETF_weights_df = pd.DataFrame(used_substrat_cum_ETF_weights, index = cum_ETF_weigths_dict['ew_based'].index)
+    return leverage_overlay(pv_dct[used_substrat_weights], cum_ETF_weigths_dict[used_substrat_weights], adj_close_price, meta_parameters, meta_leverage_parameters, overlay_builders, overlay_contributions)
+
+def leverage_overlay(used_substrat_pv, used_substrat_cum_ETF_weights, adj_close_price, meta_parameters, meta_leverage_parameters, overlay_builders = None, overlay_contributions = None):
+    # The leverages and the leveraged PV on top of the meta PV and ETF weights of the used substrategy weighting.
+    # overlay_builders: {name : builder} of the leverage overlays, default_leverage_overlays if None. overlay_contributions: optional dict, filled with the leverages of each stage.
+    stages = cprof.stage_timer('LeveragedMeta')
+    pv_df = pd.DataFrame(used_substrat_pv)
+    cum_ETF_weights_df = pd.DataFrame(used_substrat_cum_ETF_weights)
     used_pv = pv_df
     tlt_prices = adj_close_price.TLT.to_frame()
     tip_prices = adj_close_price.TIP.to_frame()
@@ -181,108 +165,68 @@ def leveraged_meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_pa
     meta_rebalance_freq = meta_parameters['meta_rebalance_freq']
     meta_rebalance_shift = meta_parameters['meta_rebalance_shift']
 
-    meta_overall_leverage = meta_leverage_parameters['meta_overall_leverage']
     meta_ETF_perf_leverage_threshol = meta_leverage_parameters['meta_ETF_perf_leverage_threshold']
     meta_ETF_perf_leverage = meta_leverage_parameters['meta_ETF_perf_leverage']
-    meta_monthly_seas_based_leverage = meta_leverage_parameters['meta_monthly_seas_based_leverage']
     meta_leverage_lookback_years = meta_leverage_parameters['meta_leverage_lookback_years']
-    meta_tlt_based_leverage = meta_leverage_parameters['meta_tlt_based_leverage']
-    meta_tip_based_leverage = meta_leverage_parameters['meta_tip_based_leverage']
 
     meta_leverage_lookback_days = meta_leverage_lookback_years * 12 * 21
     
-    df = adj_close_price.copy()
-    df['Year'], df['Month'], df['Week'] = df.index.year, df.index.month, df.index.isocalendar().week
-    df['Monthly_Rb'] = df.Month != df.Month.shift(-1)
-    df['Weekly_Rb'] = df.Week != df.Week.shift(-1)
-    df['Daily_Rb'] = True
-    df['RebalanceUnit'] = df.Monthly_Rb if meta_rebalance_unit == 'Month' else df.Weekly_Rb if meta_rebalance_unit == 'Week' else df.Daily_Rb
-    df.RebalanceUnit = df.RebalanceUnit.shift(meta_rebalance_shift).fillna(False)
-    df.RebalanceUnit[0] = True
-    df['NoPeriod'] = df.RebalanceUnit.shift(1).cumsum()
-    df.NoPeriod[0] = 0
-    df['NoData'] = np.arange(len(df)) + 1
-    df['Rebalance'] = np.where((df.RebalanceUnit == True) & (df.NoPeriod.mod(meta_rebalance_freq) == 0), True, False)
-
-    dailyretsETFs = adj_close_price / adj_close_price.shift(1) - 1
-
-    cum_rebalance_adjusted_weights = weight_recalc(df, cum_ETF_weights_df)
+    rebalance = ccal.rebalance_days(adj_close_price.index, meta_rebalance_unit, meta_rebalance_freq, meta_rebalance_shift)
 
-    dailyretsETFs_played = dailyretsETFs.where(cum_rebalance_adjusted_weights > 0, pd.NA)
+    dailyretsETFs = cfs.default_store.feature(adj_close_price, 'ret', 1)
+
+    cum_rebalance_adjusted_weights = weight_recalc(rebalance, cum_ETF_weights_df)
 
-    avg_rets_ETFs_all = dailyretsETFs.rolling(meta_leverage_lookback_days).mean()
-    std_rets_ETFs_all = dailyretsETFs.rolling(meta_leverage_lookback_days).std()
-    sharpe_ETFs_all = (avg_rets_ETFs_all / std_rets_ETFs_all * np.sqrt(252)).fillna(0)
+    dailyretsETFs_played = dailyretsETFs.where(cum_rebalance_adjusted_weights > 0, pd.NA)
 
     avg_rets_ETFs_played = dailyretsETFs_played.rolling(window = meta_leverage_lookback_days, min_periods = 1).mean()
     std_rets_ETFs_played = dailyretsETFs_played.rolling(window = meta_leverage_lookback_days, min_periods = 1).std()
     sharpe_ETFs_played = (avg_rets_ETFs_played / std_rets_ETFs_played * np.sqrt(252)).fillna(0)
 
-    rows_sharpe, cols_sharpe = sharpe_ETFs_all.shape
-    rand_mx = pd.DataFrame(np.random.rand(rows_sharpe, cols_sharpe) / 100000, index = sharpe_ETFs_all.index, columns = sharpe_ETFs_all.columns)
-    sharpe_ETFs_all = sharpe_ETFs_all + rand_mx
-    sharpe_ETFs_played =sharpe_ETFs_played + rand_mx
+    rows_sharpe, cols_sharpe = sharpe_ETFs_played.shape
+    rand_mx = np.random.rand(rows_sharpe, cols_sharpe) # tie breaking noise, added in place without panel sized temporary frames
+    rand_mx /= 100000
+    sharpe_ETFs_played += rand_mx
 
-    sharpe_ETFs_all_rank = sharpe_ETFs_all.rank(axis = 1, ascending = False).astype(int)
     sharpe_ETFs_played_rank = sharpe_ETFs_played.rank(axis = 1, ascending = False).astype(int)
+    stages.lap('signals', sharpe_ETFs_played_rank)
 
-    no_ETFs = len(sharpe_ETFs_all.columns)
+    no_ETFs = len(sharpe_ETFs_played.columns)
     no_ETFs_boxes = np.multiply(np.array(meta_ETF_perf_leverage_threshol), no_ETFs)
-    perf_based_ETF_leverage_array = np.ones(no_ETFs)
-    for pos in range(no_ETFs):
-        perf_based_ETF_leverage_array[pos] = meta_ETF_perf_leverage[np.argmax(no_ETFs_boxes > pos)]
-
-    leverages_ETFs_by_all = lev_by_rank(sharpe_ETFs_all_rank, perf_based_ETF_leverage_array, meta_leverage_lookback_years, df)
-    leverages_ETFs_by_played = lev_by_rank(sharpe_ETFs_played_rank, perf_based_ETF_leverage_array, meta_leverage_lookback_years, df)
-
-    sharpe_by_years = yearly_sharpe(used_pv)
-    sharpe_by_years_rank = sharpe_by_years.rank(axis = 1, ascending = False).fillna(99).astype(int)
-    levegare_by_month = lev_by_monthly_perf(sharpe_by_years_rank, meta_monthly_seas_based_leverage, df, meta_leverage_lookback_years)
-
-    used_leverage_by_month = levegare_by_month.MonthlyLev
-
-    tlt_prices.columns = ['TLT']
-    tlt_prices['OneM'] = tlt_prices.TLT / tlt_prices.TLT.shift(21) - 1
-    tlt_prices['ThreeM'] = tlt_prices.TLT / tlt_prices.TLT.shift(63) - 1
-    tlt_prices = tlt_prices[tlt_prices.index >= used_pv.index[0]]
-    no_tlt_days = len(tlt_prices.index)
-    tlt_leverage_by_days = np.ones(no_tlt_days)
-    for days in range(no_tlt_days):
-        if ((tlt_prices.OneM[days] >= 0) & (tlt_prices.ThreeM[days] >= 0)):
-            tlt_leverage_by_days[days] = meta_tlt_based_leverage[0]
-        elif ((tlt_prices.OneM[days] >= 0) & (tlt_prices.ThreeM[days] < 0)):
-            tlt_leverage_by_days[days] = meta_tlt_based_leverage[1]
-        elif ((tlt_prices.OneM[days] < 0) & (tlt_prices.ThreeM[days] >= 0)):
-            tlt_leverage_by_days[days] = meta_tlt_based_leverage[2]
-        else:
-            tlt_leverage_by_days[days] = meta_tlt_based_leverage[3]
-    tlt_prices['TLTLev'] = tlt_leverage_by_days
-
-    tip_leverages, curr_tip_quint  = lev_by_tip_perf(tip_prices, meta_tip_based_leverage)
-    tip_leverages_final= tip_leverages.loc[leverages_ETFs_by_all.index]
-
-    final_leverage_all = (leverages_ETFs_by_all * meta_overall_leverage).multiply(used_leverage_by_month, axis = 'index').multiply(tlt_prices.TLTLev, axis = 'index').multiply(tip_leverages_final, axis = 'index')
-    final_leverage_played = (leverages_ETFs_by_played * meta_overall_leverage).multiply(used_leverage_by_month, axis = 'index').multiply(tlt_prices.TLTLev, axis = 'index').multiply(tip_leverages_final, axis = 'index')
-
-    final_weights_all = cum_ETF_weights_df.mul(final_leverage_all)
-    final_weights_all['cash'] = 0
-    cash_all = 1 - final_weights_all.sum(axis = 1)
+    perf_based_ETF_leverage_array = np.asarray(meta_ETF_perf_leverage, dtype = float)[np.argmax(no_ETFs_boxes[np.newaxis, :] > np.arange(no_ETFs)[:, np.newaxis], axis = 1)]
+
+    leverages_ETFs_by_played = lev_by_rank(sharpe_ETFs_played_rank, perf_based_ETF_leverage_array, meta_leverage_lookback_years, rebalance)
+    stages.lap('weights', leverages_ETFs_by_played)
+
+    overlay_builders = default_leverage_overlays if overlay_builders is None else overlay_builders
+    overlay_context = {'used_pv' : used_pv, 'dates' : adj_close_price.index, 'rebalance' : rebalance, 'adj_close_price' : adj_close_price, 'tlt_prices' : tlt_prices, 'tip_prices' : tip_prices, 'meta_leverage_parameters' : meta_leverage_parameters}
+    overlays = {name : builder(overlay_context) for name, builder in overlay_builders.items()}
+    if overlay_contributions is not None:
+        # the leverages by the Sharpe ranks of all the ETFs (not only the played ones) are only calculated for the contributions, the played PV doesn't use them
+        avg_rets_ETFs_all = cfs.default_store.feature(adj_close_price, 'mean', meta_leverage_lookback_days)
+        std_rets_ETFs_all = cfs.default_store.feature(adj_close_price, 'std', meta_leverage_lookback_days)
+        sharpe_ETFs_all = (avg_rets_ETFs_all / std_rets_ETFs_all * np.sqrt(252)).fillna(0) + rand_mx
+        sharpe_ETFs_all_rank = sharpe_ETFs_all.rank(axis = 1, ascending = False).astype(int)
+        leverages_ETFs_by_all = lev_by_rank(sharpe_ETFs_all_rank, perf_based_ETF_leverage_array, meta_leverage_lookback_years, rebalance)
+        overlay_contributions.update({'ETF_rank_all' : leverages_ETFs_by_all, 'ETF_rank_played' : leverages_ETFs_by_played, **overlays})
+
+    final_leverage_played = apply_leverage_overlays(leverages_ETFs_by_played, overlays)
+    stages.lap('overlays', final_leverage_played)
+
     final_weights_played = cum_ETF_weights_df.mul(final_leverage_played)
     final_weights_played['cash'] = 0
     cash_played = 1 - final_weights_played.sum(axis = 1)
 
-    pos_all_fin, cash_all_fin, pv_all_fin = com.positions_pv(adj_close_price_wo_cash, df.Rebalance, final_weights_all, cash_all, df.index[1])
-    pos_played_fin, cash_played_fin, pv_played_fin = com.positions_pv(adj_close_price_wo_cash, df.Rebalance, final_weights_played, cash_played, df.index[1])
+    # only the played leverages are simulated, the PV of the 'all' leverages is not returned
+    fin_pos_dct, fin_cash_dct, fin_pv_dct = com.positions_pv_multi(adj_close_price_wo_cash, rebalance, {'played' : final_weights_played}, {'played' : cash_played}, adj_close_price.index[1])
+    pos_played_fin, cash_played_fin, pv_played_fin = fin_pos_dct['played'], fin_cash_dct['played'], fin_pv_dct['played']
 
-    strat_all_rets = pv_all_fin / pv_all_fin.shift(1) - 1
     strat_played_rets = pv_played_fin / pv_played_fin.shift(1) - 1
 
-    strat_all_weights = final_weights_all.copy()
-    strat_all_weights['cash'] = cash_all
     strat_played_weights = final_weights_played.copy()
     strat_played_weights['cash'] = cash_played
 
-    strat_all_curr_weights = strat_all_weights.iloc[-1]
     strat_played_curr_weights = strat_played_weights.iloc[-1]
 
-    return pv_played_fin, strat_played_rets, strat_played_weights, pos_played_fin, cash_played_fin, strat_played_curr_weights, cum_ETF_weights_df.iloc[-1], leverages_ETFs_by_played.iloc[-1], used_leverage_by_month.iloc[-1], tlt_prices.TLTLev.iloc[-1], curr_tip_quint
\ No newline at end of file
+    stages.lap('pv', pv_played_fin)
+    return pv_played_fin, strat_played_rets, strat_played_weights, pos_played_fin, cash_played_fin, strat_played_curr_weights, cum_ETF_weights_df.iloc[-1], leverages_ETFs_by_played.iloc[-1], overlays['monthly_seasonality'].iloc[-1] if 'monthly_seasonality' in overlays else np.nan, overlays['tlt_regime'].iloc[-1] if 'tlt_regime' in overlays else np.nan, overlay_context.get('curr_tip_quint', np.nan)
\ No newline at end of file
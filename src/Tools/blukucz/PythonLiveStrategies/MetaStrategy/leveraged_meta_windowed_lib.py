@@ -0,0 +1,135 @@
+# Windowed recompute of leveraged_meta() for the live end-of-day runs. It is not an incremental engine: no positions, cash, rolling accumulators, rank
+# inputs or overlay states are kept, and a new day is not advanced in O(N).
+# The state file keeps the meta PV and the cumulated ETF weights of the used substrategy weighting, together with the prices they were calculated from.
+# A new day reruns meta() (all the substrategies) on a trailing window, the stored days are kept as they are. Most signals depend on a bounded lookback of prices and the PVs
+# only enter through their returns, but not all of them: the TAA scores keep their +-1 hysteresis state for an unbounded time (hold_forward), so the window
+# run can start from an other state than the full history run. Before stitching, the window run is compared with the stored PV returns and cumulated ETF
+# weights on the overlap_check_days stored days before the first new day (after the warm-up of the window run), a difference falls back to a full recompute.
+# Anything else that can change the stored history (changed parameters, a new dividend/split adjustment in the prices, rebalance_freq > 1) falls back too.
+# The saving is the substrategy and meta history before the window, each day still costs O(T): the price panel is read for the full history, meta() runs on
+# the window and the leverage overlay runs on the whole history (5 years rolling Sharpe ranks, yearly seasonality, TIP quintiles of the full history).
+# The state is only written after the optional parity check passed, so a failed check doesn't leave a wrong history for the next run.
+
+import os
+import json
+import pickle
+import hashlib
+import pandas as pd
+import numpy as np
+import common_price_store as cps
+
+from meta_lib import meta, meta_ticker_lists
+from leveraged_meta_lib import leveraged_meta, leverage_overlay
+
+window_years = 2 # the window run of meta() starts this many years before the first recalculated day (plus the 2 years warm-up of the substrategies)
+price_change_tolerance = 1e-6 # relative change of a stored price that means the stored history is not valid any more
+parity_tolerance = 1e-9
+overlap_check_days = 126 # the last stored days before the first new day where the window run has to reproduce the stored history
+result_names = ['pv', 'rets', 'weights', 'pos', 'cash', 'curr_weights', 'curr_cum_ETF_weights', 'curr_ETF_perf_leverages', 'curr_monthly_leverage', 'curr_tlt_leverage', 'curr_tip_quintile']
+
+def state_fingerprint(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, meta_leverage_parameters, haa_parameters):
+    # meta_end_date moves every day and the parallel execution keys don't change the results, so they are not part of the fingerprint
+    meta_parameters = {k: v for k, v in meta_parameters.items() if k not in ['meta_end_date', 'meta_parallel_mode', 'meta_parallel_workers']}
+    all_parameters = [meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, meta_leverage_parameters, haa_parameters]
+    return hashlib.sha1(json.dumps(all_parameters, sort_keys = True, default = str).encode()).hexdigest()
+
+def read_state(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'rb') as f:
+        return pickle.load(f)
+
+def write_state(state_path, state):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def first_new_date(state, fingerprint, prices, all_rebalance_freqs, meta_start_date):
+    # The first day to recalculate, or None if a full recompute is needed.
+    if state is None or state['fingerprint'] != fingerprint or any(freq != 1 for freq in all_rebalance_freqs):
+        return None # with rebalance_freq > 1 the rebalance days depend on the first day of the price history
+    stored_prices = state['prices']
+    new_date = stored_prices.index[-1] # the last stored day can be an intraday price, it is always recalculated
+    if prices.index[-1] < new_date or pd.to_datetime(new_date) - pd.DateOffset(years = window_years) < pd.to_datetime(meta_start_date):
+        return None
+    stored_hist = stored_prices[stored_prices.index < new_date]
+    curr_hist = prices[prices.index < new_date]
+    if not stored_hist.index.equals(curr_hist.index) or not stored_hist.columns.equals(curr_hist.columns):
+        return None
+    stored_values, curr_values = stored_hist.to_numpy(), curr_hist.to_numpy()
+    if not np.array_equal(np.isnan(stored_values), np.isnan(curr_values)) or np.nanmax(np.abs(curr_values / stored_values - 1), initial = 0) > price_change_tolerance:
+        return None # a new dividend or split adjustment changed the price history
+    return new_date
+
+def results_differ(result, check_result):
+    differ = []
+    for name, value, check_value in zip(result_names, result, check_result):
+        value, check_value = np.asarray(value, dtype = float), np.asarray(check_value, dtype = float)
+        if value.shape != check_value.shape or not np.allclose(value, check_value, rtol = parity_tolerance, atol = parity_tolerance, equal_nan = True):
+            differ.append(name)
+    return differ
+
+def window_differs(stored_pv, stored_cum_ETF_weights, window_pv, window_cum_ETF_weights, new_date):
+    # True if the window run doesn't reproduce the stored PV returns and cumulated ETF weights on the overlap_check_days days before new_date
+    check_days = stored_pv.index[stored_pv.index < new_date][-overlap_check_days:]
+    if len(check_days) < overlap_check_days or not check_days.isin(window_pv.index).all() or check_days[0] <= window_pv.index[0]:
+        return True
+    stored_rets = (stored_pv / stored_pv.shift(1) - 1).loc[check_days].to_numpy(dtype = float)
+    window_rets = (window_pv / window_pv.shift(1) - 1).loc[check_days].to_numpy(dtype = float)
+    columns = stored_cum_ETF_weights.columns.union(window_cum_ETF_weights.columns)
+    stored_weights = stored_cum_ETF_weights.reindex(index = check_days, columns = columns).fillna(0).to_numpy(dtype = float)
+    window_weights = window_cum_ETF_weights.reindex(index = check_days, columns = columns).fillna(0).to_numpy(dtype = float)
+    return not (np.allclose(stored_rets, window_rets, rtol = parity_tolerance, atol = parity_tolerance, equal_nan = True) and np.allclose(stored_weights, window_weights, rtol = parity_tolerance, atol = parity_tolerance))
+
+def leveraged_meta_windowed(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, meta_leverage_parameters, haa_parameters, state_path, parity_check = False, price_provider = None):
+    # Same results as leveraged_meta(). With parity_check = True the result is compared to a full recompute and a difference raises an error.
+    meta_start_date = meta_parameters['meta_start_date']
+    meta_end_date = meta_parameters['meta_end_date']
+    used_substrat_weights = meta_parameters['used_substrat_weights']
+    all_rebalance_freqs = [meta_parameters['meta_rebalance_freq'], taa_parameters['taa_rebalance_freq'], bold_parameters['baa_rebalance_freq'], dual_mom_parameters['dm_rebalance_freq'], keller_protmom_parameters['protmom_rebalance_freq'], novell_tactbond_parameters['tactbond_rebalance_freq'], haa_parameters['haa_rebalance_freq']]
+    start, end = pd.to_datetime(meta_start_date) + pd.DateOffset(years= -2), pd.to_datetime(meta_end_date) + pd.DateOffset(days= 1)
+
+    list_queried, list_total = meta_ticker_lists(taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, haa_parameters)
+    shared_provider = cps.shared_panel_provider(list_queried, start, end, price_provider)
+    prices = shared_provider.adj_close(list_queried, start, end)
+    adj_close_price = shared_provider.adj_close(list_total, start, end)
+
+    fingerprint = state_fingerprint(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, meta_leverage_parameters, haa_parameters)
+    state = read_state(state_path)
+    new_date = first_new_date(state, fingerprint, prices, all_rebalance_freqs, meta_start_date)
+    rng_state = np.random.get_state() # the parity check replays the random rank tie breakers of the leverage overlay
+
+    used_pv = None
+    if new_date is not None:
+        window_meta_parameters = dict(meta_parameters, meta_start_date = (pd.to_datetime(new_date) - pd.DateOffset(years = window_years)).strftime('%Y-%m-%d'))
+        pv_dct, rets_dct, weights_dct, pos_dct, cash_dct, curr_substrats_weights_dct, curr_ETF_weights_dct, meta_adj_close_price, cum_ETF_weigths_dict = meta(window_meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, haa_parameters, shared_provider)
+        window_pv = pv_dct[used_substrat_weights]
+        window_cum_ETF_weights = cum_ETF_weigths_dict[used_substrat_weights]
+        stored_pv = state['used_pv'][state['used_pv'].index < new_date]
+        stored_cum_ETF_weights = state['used_cum_ETF_weights'][state['used_cum_ETF_weights'].index < new_date]
+        if window_differs(stored_pv, stored_cum_ETF_weights, window_pv, window_cum_ETF_weights, new_date):
+            print(f'The window run of the meta strategy differs from the stored history before {pd.to_datetime(new_date).date()} (e.g. a TAA hysteresis state older than the window).')
+        else:
+            # the window PV starts from 1, it is rescaled to continue the stored PV
+            window_pv = window_pv * (stored_pv.iloc[-1] / window_pv[stored_pv.index[-1]])
+            used_pv = pd.concat([stored_pv, window_pv[window_pv.index >= new_date]])
+            used_cum_ETF_weights = pd.concat([stored_cum_ETF_weights, window_cum_ETF_weights[window_cum_ETF_weights.index >= new_date].reindex(columns = stored_cum_ETF_weights.columns)])
+            print(f'Windowed recompute of the meta strategy from {pd.to_datetime(new_date).date()}, {(used_pv.index >= new_date).sum()} day(s) recalculated.')
+    if used_pv is None:
+        print('Full recompute of the meta strategy.')
+        pv_dct, rets_dct, weights_dct, pos_dct, cash_dct, curr_substrats_weights_dct, curr_ETF_weights_dct, meta_adj_close_price, cum_ETF_weigths_dict = meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, haa_parameters, shared_provider)
+        used_pv = pv_dct[used_substrat_weights]
+        used_cum_ETF_weights = cum_ETF_weigths_dict[used_substrat_weights]
+
+    result = leverage_overlay(used_pv, used_cum_ETF_weights, adj_close_price, meta_parameters, meta_leverage_parameters)
+
+    if parity_check:
+        np.random.set_state(rng_state)
+        check_result = leveraged_meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, meta_leverage_parameters, haa_parameters, shared_provider)
+        differ = results_differ(result, check_result)
+        if len(differ) > 0:
+            raise ValueError(f'SqError. The windowed meta strategy differs from the full recompute in {differ}. The state file {state_path} was not updated.')
+        print('Parity check OK: the windowed result equals the full recompute.')
+    write_state(state_path, {'fingerprint' : fingerprint, 'prices' : prices, 'used_pv' : used_pv, 'used_cum_ETF_weights' : used_cum_ETF_weights})
+    return result
@@ -11,23 +11,15 @@ import warnings
 warnings.filterwarnings('ignore')
 
 # Importing necessary libraries
-import sys
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import yfinance as yf
-import pyfolio as pf
-import datetime as dt
-import pandas_datareader.data as web
 import os
 import common_aa_pv as com
-
-
-
-# print all outputs
-from IPython.core.interactiveshell import InteractiveShell
-InteractiveShell.ast_node_interactivity = "all"
-from scipy.stats import rankdata
+import common_price_store as cps
+import common_calendar as ccal
+import common_feature_store as cfs
+import common_profiler as cprof
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import reduce
 
 from taa_lib import taa
@@ -38,19 +30,60 @@ from novelltactbond_lib import novelltactbond
 from haa_lib import haa
 
 
+def meta_ticker_lists(taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, hybrid_aa_parameters):
+    # All the tickers queried by the substrategies (KellerProtMom adds IEF, NovellTactBond adds BIL) and the tickers whose prices meta() returns (the BAA canary ones only as signals).
+    list_total = list(set(taa_parameters['taa_ticker_list'] + bold_parameters['baa_ticker_list_aggressive'] + bold_parameters['baa_ticker_list_balanced'] + bold_parameters['baa_ticker_list_defensive'] + dual_mom_parameters['dm_tickers_list'] + keller_protmom_parameters['protmom_tickers_list'] + ['IEF'] + novell_tactbond_parameters['tactbond_tickers_list'] + ['BIL'] + hybrid_aa_parameters['haa_ticker_list_canary'] + hybrid_aa_parameters['haa_ticker_list_defensive'] + hybrid_aa_parameters['haa_ticker_list_offensive']))
+    list_queried = list(set(list_total + bold_parameters['baa_ticker_list_canary']))
+    return list_queried, list_total
+
+def pv_and_weights(substrat_result):
+    return substrat_result.pv, substrat_result.weights, substrat_result.curr_weights
+
+def run_substrat(substrat_name, substrat_func, substrat_args):
+    try:
+        substrat_result = substrat_func(*substrat_args)
+        # the lazy PV simulations run in the worker, not serially in the parent after the pool returned. baa() returns a {variant : result} dict.
+        for variant_result in (substrat_result.values() if isinstance(substrat_result, dict) else [substrat_result]):
+            pv_and_weights(variant_result)
+        return substrat_result
+    except Exception as e:
+        raise RuntimeError(f'SqError. Sub-strategy {substrat_name} failed. {type(e).__name__}: {e}') from e
+
+def substrat_cache_key(substrat_name, substrat_args):
+    # The parameters and the panel_key of the price provider (dtype, dates and price digests): a sweep mixing compact and float64 runs, or other price
+    # panels, never gets the results of an other panel. None (not cached) if a price provider has no panel_key.
+    provider_keys = [getattr(arg, 'panel_key', None) for arg in substrat_args if hasattr(arg, 'adj_close')]
+    if any(key is None for key in provider_keys):
+        return None
+    return (substrat_name, repr([arg for arg in substrat_args if not hasattr(arg, 'adj_close')]), tuple(provider_keys))
+
+def run_substrats(substrat_calls_p, parallel_mode_p = 'serial', max_workers_p = None, cache_p = None):
+    # substrat_calls_p: {name : (function, args)}. The sub-strategies are independent until their PVs are concatenated, so they can run side by side.
+    # 'thread' mode is enough if the prices still have to be downloaded, 'process' mode uses all the cores for the CPU bound calculations.
+    # The results are collected by name, so they don't depend on the finishing order of the workers.
+    # cache_p: optional dict shared by meta() runs over the same prices (parameter sweeps), a substrategy only runs again if its parameters changed.
+    cache_keys = {name : substrat_cache_key(name, args) for name, (func, args) in substrat_calls_p.items()}
+    cached = {} if cache_p is None else {name : cache_p[key] for name, key in cache_keys.items() if key is not None and key in cache_p}
+    pending = {name : call for name, call in substrat_calls_p.items() if name not in cached}
+    if parallel_mode_p == 'serial' or len(pending) == 0:
+        results = {name : run_substrat(name, func, args) for name, (func, args) in pending.items()}
+    else:
+        if parallel_mode_p == 'process':
+            executor_class = ProcessPoolExecutor
+        elif parallel_mode_p == 'thread':
+            executor_class = ThreadPoolExecutor
+        else:
+            raise ValueError(f"SqError. Unknown meta_parallel_mode: '{parallel_mode_p}'. Use 'serial', 'thread' or 'process'.")
+        max_workers = min(len(pending), os.cpu_count() or 1) if max_workers_p is None else max_workers_p
+        with executor_class(max_workers = max_workers) as executor:
+            futures = {name : executor.submit(run_substrat, name, func, args) for name, (func, args) in pending.items()}
+            results = {name : future.result() for name, future in futures.items()}
+    if cache_p is not None:
+        cache_p.update({cache_keys[name] : result for name, result in results.items() if cache_keys[name] is not None})
+    return {name : cached[name] if name in cached else results[name] for name in substrat_calls_p}
 
 def meta_perf_based_weights(substrat_rank_p, substrat_weights_p, performance_p, substrat_abs_threshold):
-    ranknums = substrat_rank_p.to_numpy()
-    perform = performance_p.to_numpy()
-    ranknums = ranknums.astype(int)
-    no_rows, no_cols = substrat_rank_p.shape
-    weights = np.zeros((no_rows, no_cols))
-
-    for i in range(no_rows):
-        for j in range(no_cols):
-            if perform[i, j] > substrat_abs_threshold:
-                weights[i, j] = substrat_weights_p[ranknums[i, j] - 1]
-
+    weights = com.rank_lookup(substrat_rank_p.to_numpy(), substrat_weights_p, performance_p.to_numpy() > substrat_abs_threshold)
     weights_df = pd.DataFrame(weights, index = substrat_rank_p.index, columns = substrat_rank_p.columns)
     cash_weights = 1 - weights_df.sum(axis = 1)
     return weights_df, cash_weights
@@ -81,7 +114,8 @@ def cum_ETF_weights(meta_weights, weights_substrat_dict_p):
     ETF_weights['cash'] += cash
     return ETF_weights
 
-def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, hybrid_aa_parameters):
+@cprof.profiled('meta') # meta(..., profiler = cprof.Profiler()) records the stages of the call
+def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, hybrid_aa_parameters, price_provider = None, substrat_cache = None):
 
     meta_rebalance_unit = meta_parameters['meta_rebalance_unit']
     meta_rebalance_freq = meta_parameters['meta_rebalance_freq']
@@ -97,6 +131,9 @@ def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters,
     meta_sortino_abs_threshold = meta_parameters['meta_sortino_abs_threshold']
     meta_start_date = meta_parameters['meta_start_date']
     meta_end_date = meta_parameters['meta_end_date']
+    meta_parallel_mode = meta_parameters.get('meta_parallel_mode', 'serial') # 'serial', 'thread', 'process'
+    meta_parallel_workers = meta_parameters.get('meta_parallel_workers', None) # None: one worker per sub-strategy, at most the number of cores
+    meta_compact_mode = meta_parameters.get('meta_compact_mode', False) # True: float32 price panel, cached features and substrategy positions, not bit for bit with the float64 run (see cps.PanelPriceProvider)
 
     taa_ticker_list = taa_parameters['taa_ticker_list']
     taa_perc_ch_lb_list = taa_parameters['taa_perc_ch_lb_list']
@@ -158,20 +195,37 @@ def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters,
     haa_no_played_ETFs = hybrid_aa_parameters['haa_no_played_ETFs']
     haa_abs_threshold = hybrid_aa_parameters['haa_abs_threshold']
 
-    taa_pv, taa_strat_rets, taa_weights, taa_pos, taa_cash, taa_curr_weights, taa_pv_ew, taa_strat_rets_ew, taa_pos_ew, taa_cash_ew =taa(taa_ticker_list, taa_perc_ch_lb_list, taa_vol_lb, taa_perc_ch_up_thres, taa_perc_ch_low_thres, taa_rebalance_unit, taa_rebalance_freq, taa_rebalance_shift, meta_start_date, meta_end_date)
-    baa_pv, baa_strat_rets, baa_weights, baa_pos, baa_cash, baa_curr_weights, baa_pv_ew, baa_strat_rets_ew, baa_pos_ew, baa_cash_ew = baa('agg_def', baa_ticker_list_canary, baa_ticker_list_defensive, baa_ticker_list_aggressive, baa_ticker_list_balanced, baa_rebalance_unit, baa_rebalance_freq, baa_rebalance_shift, baa_skipped_period, baa_no_played_ETFs, baa_abs_threshold, meta_start_date, meta_end_date)
-    baa2_pv, baa2_strat_rets, baa2_weights, baa2_pos, baa2_cash, baa2_curr_weights, baa2_pv_ew, baa2_strat_rets_ew, baa2_pos_ew, baa2_cash_ew = baa('bal_def', baa_ticker_list_canary, baa_ticker_list_defensive, baa_ticker_list_aggressive, baa_ticker_list_balanced, baa_rebalance_unit, baa_rebalance_freq, baa_rebalance_shift, baa_skipped_period, baa_no_played_ETFs, baa_abs_threshold, meta_start_date, meta_end_date)
-    dm_pv, dm_strat_rets, dm_weights, dm_pos, dm_cash, dm_curr_weights, dm_pv_ew, dm_strat_rets_ew, dm_pos_ew, dm_cash_ew = dualmom(dm_tickers_list, dm_rebalance_unit, dm_rebalance_freq, dm_rebalance_shift, dm_lb_period, dm_skipped_period, dm_no_played_ETFs, dm_sub_rank_weights, dm_abs_threshold, meta_start_date, meta_end_date)
-    pm_pv, pm_strat_rets, pm_weights, pm_pos, pm_cash, pm_curr_weights, pm_pv_ew, pm_strat_rets_ew, pm_pos_ew, pm_cash_ew = kellerprotmom(protmom_tickers_list, protmom_rebalance_unit, protmom_rebalance_freq, protmom_rebalance_shift, protmom_correl_lb_months, protmom_lb_periods, protmom_lb_weights, protmom_selected_ETFs, meta_start_date, meta_end_date)
-    tb_pv, tb_strat_rets, tb_weights, tb_pos, tb_cash, tb_curr_weights, tb_pv_ew, tb_strat_rets_ew, tb_pos_ew, tb_cash_ew = novelltactbond(tactbond_tickers_list, tactbond_rebalance_unit, tactbond_rebalance_freq, tactbond_rebalance_shift, tactbond_absolute_threshold, tactbond_threshold_type, tactbond_cash_subs, tactbond_lb_periods, tactbond_lb_weights, tactbond_selected_ETFs, meta_start_date, meta_end_date)
-    haa_pv, haa_strat_rets, haa_weights, haa_pos, haa_cash, haa_curr_weights, haa_pv_ew, haa_strat_rets_ew, haa_pos_ew, haa_cash_ew = haa(haa_ticker_list_canary, haa_ticker_list_defensive, haa_ticker_list_offensive, haa_rebalance_unit, haa_rebalance_freq, haa_rebalance_shift, haa_skipped_period, haa_no_played_ETFs, haa_abs_threshold, meta_start_date, meta_end_date)
+    stages = cprof.stage_timer('Meta')
+    # One bulk price request for the union of all tickers, the sub-strategies get column views of this shared panel.
+    list_queried, list_total = meta_ticker_lists(taa_parameters, bold_parameters, dual_mom_parameters, keller_protmom_parameters, novell_tactbond_parameters, hybrid_aa_parameters)
+    shared_provider = cps.shared_panel_provider(list_queried, pd.to_datetime(meta_start_date) + pd.DateOffset(years= -2), pd.to_datetime(meta_end_date) + pd.DateOffset(days= 1), price_provider, np.float32 if meta_compact_mode else float)
+    stages.lap('download')
+
+    substrat_calls = {
+        'TAA' : (taa, (taa_ticker_list, taa_perc_ch_lb_list, taa_vol_lb, taa_perc_ch_up_thres, taa_perc_ch_low_thres, taa_rebalance_unit, taa_rebalance_freq, taa_rebalance_shift, meta_start_date, meta_end_date, shared_provider)),
+        'BAA' : (baa, (['agg_def', 'bal_def'], baa_ticker_list_canary, baa_ticker_list_defensive, baa_ticker_list_aggressive, baa_ticker_list_balanced, baa_rebalance_unit, baa_rebalance_freq, baa_rebalance_shift, baa_skipped_period, baa_no_played_ETFs, baa_abs_threshold, meta_start_date, meta_end_date, shared_provider)),
+        'DualMom' : (dualmom, (dm_tickers_list, dm_rebalance_unit, dm_rebalance_freq, dm_rebalance_shift, dm_lb_period, dm_skipped_period, dm_no_played_ETFs, dm_sub_rank_weights, dm_abs_threshold, meta_start_date, meta_end_date, shared_provider)),
+        'KellerProtMom' : (kellerprotmom, (protmom_tickers_list, protmom_rebalance_unit, protmom_rebalance_freq, protmom_rebalance_shift, protmom_correl_lb_months, protmom_lb_periods, protmom_lb_weights, protmom_selected_ETFs, meta_start_date, meta_end_date, shared_provider)),
+        'NovellTactBond' : (novelltactbond, (tactbond_tickers_list, tactbond_rebalance_unit, tactbond_rebalance_freq, tactbond_rebalance_shift, tactbond_absolute_threshold, tactbond_threshold_type, tactbond_cash_subs, tactbond_lb_periods, tactbond_lb_weights, tactbond_selected_ETFs, meta_start_date, meta_end_date, shared_provider)),
+        'HAA' : (haa, (haa_ticker_list_canary, haa_ticker_list_defensive, haa_ticker_list_offensive, haa_rebalance_unit, haa_rebalance_freq, haa_rebalance_shift, haa_skipped_period, haa_no_played_ETFs, haa_abs_threshold, meta_start_date, meta_end_date, shared_provider))
+    }
+    substrat_results = run_substrats(substrat_calls, meta_parallel_mode, meta_parallel_workers, substrat_cache)
+    stages.lap('substrats')
+    # meta() only uses the PVs and weights of the substrategy results, their EW benchmarks and returns are not calculated
+    taa_pv, taa_weights, taa_curr_weights = pv_and_weights(substrat_results['TAA'])
+    baa_pv, baa_weights, baa_curr_weights = pv_and_weights(substrat_results['BAA']['agg_def'])
+    baa2_pv, baa2_weights, baa2_curr_weights = pv_and_weights(substrat_results['BAA']['bal_def'])
+    dm_pv, dm_weights, dm_curr_weights = pv_and_weights(substrat_results['DualMom'])
+    pm_pv, pm_weights, pm_curr_weights = pv_and_weights(substrat_results['KellerProtMom'])
+    tb_pv, tb_weights, tb_curr_weights = pv_and_weights(substrat_results['NovellTactBond'])
+    haa_pv, haa_weights, haa_curr_weights = pv_and_weights(substrat_results['HAA'])
+    stages.lap('substrat_pv', [taa_pv, baa_pv, baa2_pv, dm_pv, pm_pv, tb_pv, haa_pv])
 
     # If YF missing a day for all ETFs then it doesn't return that day, and that substrategy pv.Length is smaller. Usually if SPY is queried we have all days. But NovelTactBond doesn't query SPY.
     isAllSubStrategyHasSameDays = (taa_pv.size == baa_pv.size) and (taa_pv.size == baa2_pv.size) and (taa_pv.size == dm_pv.size) and (taa_pv.size == pm_pv.size) and (taa_pv.size == tb_pv.size) and (taa_pv.size == haa_pv.size)
     if not isAllSubStrategyHasSameDays:
         errMsg = f'taa_pv.size: {taa_pv.size}, baa_pv.size: {baa_pv.size}, baa2_pv.size: {baa2_pv.size}, dm_pv.size: {dm_pv.size}, pm_pv.size: {pm_pv.size}, tb_pv.size: {tb_pv.size}, haa_pv.size: {haa_pv.size}'
-        print('SqError. Not all strategy has the same number of days. This usually happens if one (or almost all except SPY) ETF price is missing from YF. There is not much to do. Wait until YF has all the historical data for all ETFs. ' + errMsg)
-        sys.exit()
+        raise ValueError('SqError. Not all strategy has the same number of days. This usually happens if one (or almost all except SPY) ETF price is missing from YF. There is not much to do. Wait until YF has all the historical data for all ETFs. ' + errMsg)
 
     taa_weights = taa_weights.groupby(taa_weights.columns, axis = 1).sum()
     baa_weights = baa_weights.groupby(baa_weights.columns, axis = 1).sum()
@@ -181,8 +235,7 @@ def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters,
     tb_weights = tb_weights.groupby(tb_weights.columns, axis = 1).sum()
     haa_weights = haa_weights.groupby(haa_weights.columns, axis = 1).sum()
 
-    list_total = list(set(taa_ticker_list + baa_ticker_list_aggressive + baa_ticker_list_balanced + baa_ticker_list_defensive + dm_tickers_list + protmom_tickers_list + tactbond_tickers_list + haa_ticker_list_canary + haa_ticker_list_defensive + haa_ticker_list_offensive))
-    adj_close_price = yf.download(list_total,start = pd.to_datetime(meta_start_date) + pd.DateOffset(years= -2),end = pd.to_datetime(meta_end_date) + pd.DateOffset(days= 1), auto_adjust=False )['Adj Close'] # 2025-02-27: yf API changed. The default auto_adjust=True gives only adjusted OHLC, not giving AdjClose, so impossible to reverse engineer the splits, dividindends and rawPrices. The auto_adjust=false gives OHLC (raw) + 'Adj Close'.
+    adj_close_price = shared_provider.adj_close(list_total, start = pd.to_datetime(meta_start_date) + pd.DateOffset(years= -2), end = pd.to_datetime(meta_end_date) + pd.DateOffset(days= 1))
 
     # get the last 63 rows of the dataframe and check for NaN values - last 3 months
     last_63_rows = adj_close_price.tail(63)
@@ -192,36 +245,18 @@ def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters,
         print(f"The following ticker(s) has missing prices in the last 3 months: {columns_with_nan}")
 
     meta_pvs = pd.concat([dm_pv, baa_pv, baa2_pv, taa_pv, pm_pv, tb_pv, haa_pv], axis = 1, keys = ['DualMom', 'BAA_AggDef', 'BAA_BalDef', 'TAA', 'KellerProtMom', 'NovellTactBond', 'HAA'])
-    df = meta_pvs.copy()
-    df['Year'], df['Month'], df['Week'] = df.index.year, df.index.month, df.index.isocalendar().week
-    df['Monthly_Rb'] = df.Month != df.Month.shift(-1)
-    df['Weekly_Rb'] = df.Week != df.Week.shift(-1)
-    df['Daily_Rb'] = True
-    df['RebalanceUnit'] = df.Monthly_Rb if meta_rebalance_unit == 'Month' else df.Weekly_Rb if meta_rebalance_unit == 'Week' else df.Daily_Rb
-    df.RebalanceUnit = df.RebalanceUnit.shift(meta_rebalance_shift).fillna(False)
-    df.RebalanceUnit[0] = True
-    df['NoPeriod'] = df.RebalanceUnit.shift(1).cumsum()
-    df.NoPeriod[0] = 0
-    df['NoData'] = np.arange(len(df)) + 1
-    df['Rebalance'] = np.where((df.RebalanceUnit == True) & (df.NoPeriod.mod(meta_rebalance_freq) == 0), True, False)
-
-    meta_dailyret = meta_pvs / meta_pvs.shift(1) - 1
+    rebalance = ccal.rebalance_days(meta_pvs.index, meta_rebalance_unit, meta_rebalance_freq, meta_rebalance_shift)
 
     lb_days_base = {'Month' : 21, 'Week' : 5, 'Day' : 1}
     lb_days = lb_days_base[meta_rebalance_unit] * meta_lb_period
     lb_days_with_skipped = lb_days_base[meta_rebalance_unit] * (meta_lb_period + meta_skipped_period)
 
-    meta_rel_mom_rets = meta_pvs.shift(lb_days_base[meta_rebalance_unit] * meta_skipped_period) / meta_pvs.shift(lb_days_with_skipped) - 1
+    meta_rel_mom_rets = cfs.default_store.feature(meta_pvs, 'ret', lb_days, lb_days_base[meta_rebalance_unit] * meta_skipped_period)
     
-    avg_rets_helper = meta_dailyret.rolling(lb_days).mean()
-    avg_rets = avg_rets_helper.shift(lb_days_base[meta_rebalance_unit] * meta_skipped_period)
-  
-    sd_rets_helper = meta_dailyret.rolling(lb_days).std()
-    sd_rets = sd_rets_helper.shift(lb_days_base[meta_rebalance_unit] * meta_skipped_period)
+    avg_rets = cfs.default_store.feature(meta_pvs, 'mean', lb_days, lb_days_base[meta_rebalance_unit] * meta_skipped_period)
+    sd_rets = cfs.default_store.feature(meta_pvs, 'std', lb_days, lb_days_base[meta_rebalance_unit] * meta_skipped_period)
     
-    meta_neg_dailyret = (meta_dailyret).where(meta_dailyret < 0, 0)
-    sd_neg_rets_helper = meta_neg_dailyret.rolling(lb_days).std()
-    sd_neg_rets = sd_neg_rets_helper.shift(lb_days_base[meta_rebalance_unit] * meta_skipped_period)
+    sd_neg_rets = cfs.default_store.feature(meta_pvs, 'neg_std', lb_days, lb_days_base[meta_rebalance_unit] * meta_skipped_period)
 
     meta_sharpe = avg_rets / sd_rets * np.sqrt(252)
     meta_sortino = avg_rets / sd_neg_rets * np.sqrt(252)
@@ -236,6 +271,7 @@ def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters,
     meta_rel_mom_rets_rank = meta_rel_mom_rets_rank_helper.rank(axis = 1, ascending = True)
     meta_sharpe_rank = meta_sharpe_rank_helper.rank(axis = 1, ascending = True)
     meta_sortino_rank = meta_sortino_rank_helper.rank(axis = 1, ascending = True)
+    stages.lap('signals', meta_sharpe_rank)
     
     meta_rel_mom_substrat_weights_used = np.divide(meta_rel_mom_substrat_weights, sum(meta_rel_mom_substrat_weights))
     meta_sharpe_substrat_weights_used = np.divide(meta_sharpe_substrat_weights, sum(meta_sharpe_substrat_weights))
@@ -251,12 +287,18 @@ def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters,
     meta_sharpe_based_weights, meta_sharpe_based_cash_weights = meta_perf_based_weights(meta_sharpe_rank, meta_sharpe_substrat_weights_used, meta_sharpe, meta_sharpe_abs_threshold)
     meta_sortino_based_weights, meta_sortino_based_cash_weights = meta_perf_based_weights(meta_sortino_rank, meta_sortino_substrat_weights_used, meta_sortino, meta_sortino_abs_threshold)
 
-    pos_fixed, cash_fixed, pv_fixed = com.positions_pv(meta_pvs, df.Rebalance, meta_fixed_weights, meta_fixed_cash_weights, meta_start_date)
-    pos_ew_based, cash_ew_based, pv_ew_based = com.positions_pv(meta_pvs, df.Rebalance, meta_ew_weights, meta_ew_cash_weights, meta_start_date)
-    pos_rel_mom, cash_rel_mom, pv_rel_mom = com.positions_pv(meta_pvs, df.Rebalance, meta_rel_mom_based_weights, meta_rel_mom_based_cash_weights, meta_start_date)
-    pos_sharpe, cash_sharpe, pv_sharpe = com.positions_pv(meta_pvs, df.Rebalance, meta_sharpe_based_weights, meta_sharpe_based_cash_weights, meta_start_date)
-    pos_sortino, cash_sortino, pv_sortino = com.positions_pv(meta_pvs, df.Rebalance, meta_sortino_based_weights, meta_sortino_based_cash_weights, meta_start_date)
-    pos_ew, cash_ew, pv_ew = com.positions_pv_ew(meta_pvs, df.Rebalance, meta_start_date)
+    # all weighting schemes share the substrategy PVs and rebalance days, so they are simulated in one batched pass
+    meta_weights_dct = {'fixed_based' : meta_fixed_weights, 'ew_based' : meta_ew_weights, 'rel_mom_based' : meta_rel_mom_based_weights, 'sharpe_based' : meta_sharpe_based_weights, 'sortino_based' : meta_sortino_based_weights}
+    meta_cash_weights_dct = {'fixed_based' : meta_fixed_cash_weights, 'ew_based' : meta_ew_cash_weights, 'rel_mom_based' : meta_rel_mom_based_cash_weights, 'sharpe_based' : meta_sharpe_based_cash_weights, 'sortino_based' : meta_sortino_based_cash_weights}
+    stages.lap('weights', meta_weights_dct)
+    meta_pos_dct, meta_cash_dct, meta_pv_dct = com.positions_pv_multi(meta_pvs, rebalance, meta_weights_dct, meta_cash_weights_dct, meta_start_date)
+    pos_fixed, cash_fixed, pv_fixed = meta_pos_dct['fixed_based'], meta_cash_dct['fixed_based'], meta_pv_dct['fixed_based']
+    pos_ew_based, cash_ew_based, pv_ew_based = meta_pos_dct['ew_based'], meta_cash_dct['ew_based'], meta_pv_dct['ew_based']
+    pos_rel_mom, cash_rel_mom, pv_rel_mom = meta_pos_dct['rel_mom_based'], meta_cash_dct['rel_mom_based'], meta_pv_dct['rel_mom_based']
+    pos_sharpe, cash_sharpe, pv_sharpe = meta_pos_dct['sharpe_based'], meta_cash_dct['sharpe_based'], meta_pv_dct['sharpe_based']
+    pos_sortino, cash_sortino, pv_sortino = meta_pos_dct['sortino_based'], meta_cash_dct['sortino_based'], meta_pv_dct['sortino_based']
+    pos_ew, cash_ew, pv_ew = com.positions_pv_ew(meta_pvs, rebalance, meta_start_date)
+    stages.lap('pv', meta_pv_dct)
 
     ew_rets = pv_ew / pv_ew.shift(1) - 1
     fixed_rets = pv_fixed / pv_fixed.shift(1) - 1
@@ -306,4 +348,5 @@ def meta(meta_parameters, taa_parameters, bold_parameters, dual_mom_parameters,
     curr_ETF_weights_dct = {'fixed_based' : fixed_curr_ETF_weights, 'ew_based' : ew_based_curr_ETF_weights, 'rel_mom_based' : rel_mom_curr_ETF_weights, 'sharpe_based' : sharpe_curr_ETF_weights, 'sortino_based' : sortino_curr_ETF_weights}
     cum_ETF_weights_dct = {'fixed_based' : cum_fixed_based_weights, 'ew_based' : cum_ew_based_weights, 'rel_mom_based' : cum_rel_mom_based_weights, 'sharpe_based' : cum_sharpe_based_weights, 'sortino_based' : cum_sortino_based_weights}
 
+    stages.lap('cum_weights', cum_ETF_weights_dct)
     return pv_dct, rets_dct, weights_dct, pos_dct, cash_dct, curr_substrats_weights_dct, curr_ETF_weights_dct, adj_close_price, cum_ETF_weights_dct
\ No newline at end of file
@@ -0,0 +1,160 @@
+# Parameter sweep of the (leveraged) meta strategy: every combination of a parameter grid is run and scored by CAGR, Sharpe, MDD and MAR.
+# The grid keys are the parameter names of the notebook dicts (e.g. 'meta_lb_period', 'taa_vol_lb', 'dm_sub_rank_weights'), they are unique across the dicts.
+# The combinations share one price panel (one download for the union of all tickers), and the substrategy results are cached by their parameters,
+# so a sweep of the meta or leverage parameters runs the seven substrategies only once.
+# walk_forward() validates a grid on rolling in-sample / out-of-sample windows: every combination is run once over the whole period, and the
+# PV of each window is the full-run PV restarted on the window start (com.restarted_pvs), so no window recalculates the signals or downloads.
+
+import copy
+import itertools
+import pandas as pd
+import numpy as np
+import common_price_store as cps
+import common_perf_ana as cpa
+import common_feature_store as cfs
+import common_aa_pv as com
+import common_calendar as ccal
+
+from meta_lib import meta, meta_ticker_lists
+from leveraged_meta_lib import leveraged_meta
+
+parameter_dict_names = ['meta_parameters', 'taa_parameters', 'bold_parameters', 'dual_mom_parameters', 'keller_protmom_parameters', 'novell_tactbond_parameters', 'meta_leverage_parameters', 'haa_parameters']
+
+def grid_combinations(base_parameters, grid):
+    # base_parameters: {dict name : parameter dict}, grid: {parameter name : list of values}. Returns the swept values and the full parameter dicts of each combination.
+    grid_dict_names = {}
+    for key in grid:
+        dict_names = [dict_name for dict_name in parameter_dict_names if key in base_parameters[dict_name]]
+        if len(dict_names) != 1:
+            raise ValueError(f"SqError. The sweep parameter '{key}' is not a parameter of exactly one of {parameter_dict_names}.")
+        grid_dict_names[key] = dict_names[0]
+    combinations = []
+    for values in itertools.product(*grid.values()):
+        parameters = copy.deepcopy(base_parameters)
+        for key, value in zip(grid.keys(), values):
+            parameters[grid_dict_names[key]][key] = value
+        combinations.append((dict(zip(grid.keys(), values)), parameters))
+    return combinations
+
+def pv_metrics(pv_p):
+    metrics = cpa.perf_metrics(pv_p).iloc[0]
+    return {'CAGR' : metrics['CAGR'], 'Sharpe' : metrics['Sharpe'], 'MDD' : metrics['MDD'], 'MAR' : metrics['MAR']}
+
+def sweep_provider(combinations, price_provider):
+    # one price panel for the tickers and dates of all the combinations
+    all_tickers = sorted(set(ticker for values, parameters in combinations for ticker in meta_ticker_lists(parameters['taa_parameters'], parameters['bold_parameters'], parameters['dual_mom_parameters'], parameters['keller_protmom_parameters'], parameters['novell_tactbond_parameters'], parameters['haa_parameters'])[0]))
+    start = min(pd.to_datetime(parameters['meta_parameters']['meta_start_date']) for values, parameters in combinations) + pd.DateOffset(years= -2)
+    end = max(pd.to_datetime(parameters['meta_parameters']['meta_end_date']) for values, parameters in combinations) + pd.DateOffset(days= 1)
+    return cps.shared_panel_provider(all_tickers, start, end, price_provider)
+
+def combination_pv(parameters, target, shared_provider, substrat_cache):
+    # target: 'leveraged_meta' is the played leveraged PV, 'meta' is the PV of the used_substrat_weights weighting (no leverage overlay).
+    if target == 'leveraged_meta':
+        return leveraged_meta(*[parameters[dict_name] for dict_name in parameter_dict_names], shared_provider, substrat_cache)[0]
+    meta_parameter_dicts = [parameters[dict_name] for dict_name in parameter_dict_names if dict_name != 'meta_leverage_parameters']
+    return meta(*meta_parameter_dicts, shared_provider, substrat_cache)[0][parameters['meta_parameters']['used_substrat_weights']]
+
+def param_sweep(base_parameters, grid, target = 'leveraged_meta', result_path = None, random_seed = 1, price_provider = None):
+    # target: see combination_pv(). random_seed: the leverage overlay breaks rank ties randomly, every combination gets the same random numbers. None keeps the global random state.
+    combinations = grid_combinations(base_parameters, grid)
+    shared_provider = sweep_provider(combinations, price_provider)
+    substrat_cache = {}
+
+    results = []
+    for no_combination, (values, parameters) in enumerate(combinations):
+        if random_seed is not None:
+            np.random.seed(random_seed)
+        try:
+            metrics = pv_metrics(combination_pv(parameters, target, shared_provider, substrat_cache))
+        except Exception as e:
+            print(f'SqError. Sweep combination {no_combination} {values} failed. {type(e).__name__}: {e}')
+            metrics = {'CAGR' : np.nan, 'Sharpe' : np.nan, 'MDD' : np.nan, 'MAR' : np.nan}
+        results.append({**{key : str(value) if isinstance(value, (list, dict)) else value for key, value in values.items()}, **metrics})
+        print(f'Sweep {no_combination + 1}/{len(combinations)}: {values} ' + ', '.join(f'{k}: {v:.3f}' for k, v in metrics.items()))
+
+    print(f'Feature store: {cfs.default_store.stats()}')
+    results_df = pd.DataFrame(results)
+    if result_path is not None:
+        results_df.to_csv(result_path, index = False)
+    return results_df
+
+def walk_forward_windows(start_date, end_date, in_sample_years, out_of_sample_years, anchored = False):
+    # (in-sample start, out-of-sample start, out-of-sample end) of each window. The out-of-sample periods follow each other from start_date + in_sample_years,
+    # the in-sample period is the in_sample_years before them (anchored: from start_date). The last out-of-sample period is cut at end_date.
+    start, end = pd.to_datetime(start_date), pd.to_datetime(end_date)
+    windows = []
+    oos_start = start + pd.DateOffset(years = in_sample_years)
+    while oos_start < end:
+        oos_end = min(oos_start + pd.DateOffset(years = out_of_sample_years), end)
+        windows.append((start if anchored else oos_start - pd.DateOffset(years = in_sample_years), oos_start, oos_end))
+        oos_start = oos_end
+    return windows
+
+def window_pvs(pvs_p, rebalance_p, start_date, end_date, last_window = False):
+    # the PVs restarted on start_date, until the day before end_date (until end_date in the last window)
+    restarted = com.restarted_pvs(pvs_p, rebalance_p, start_date)
+    return restarted[(restarted.index <= end_date) if last_window else (restarted.index < end_date)]
+
+def stitched_pvs(segments):
+    # the out-of-sample PV segments chained into one equity curve: each segment starts on the last day of the previous one, at its PV
+    stitched = [segments[0]]
+    for segment in segments[1:]:
+        stitched.append(segment.iloc[1:] * stitched[-1].iloc[-1])
+    return pd.concat(stitched)
+
+def walk_forward(base_parameters, grid, in_sample_years = 3, out_of_sample_years = 1, select_metric = 'Sharpe', target = 'leveraged_meta', anchored = False, random_seed = 1, price_provider = None):
+    # Walk-forward validation of a parameter grid between meta_start_date and meta_end_date of base_parameters. Every combination is run once over the whole period,
+    # the signals of all the windows are the ones of this run. In each window the combination with the best in-sample select_metric (a cpa.perf_metric_names column,
+    # the lowest for 'MDD') is played out of sample. Returns a dict of the frames:
+    #   'windows': one row per window with its dates, the selected combination and its in-sample and out-of-sample select_metric
+    #   'in_sample_metrics': the in-sample metrics of all the combinations in all the windows (tidy, one row per window and combination)
+    #   'out_of_sample_pvs': the stitched out-of-sample PV of every combination (columns) and of the walk-forward selection ('walk_forward' column)
+    #   'out_of_sample_metrics': cpa.perf_metrics() of the stitched out-of-sample PVs
+    for key in ['meta_start_date', 'meta_end_date']:
+        if key in grid:
+            raise ValueError(f"SqError. The walk-forward windows are set by in_sample_years and out_of_sample_years, '{key}' cannot be swept.")
+    if select_metric not in cpa.perf_metric_names:
+        raise ValueError(f"SqError. Unknown walk-forward select metric: '{select_metric}'. Use one of {cpa.perf_metric_names}.")
+    combinations = grid_combinations(base_parameters, grid)
+    shared_provider = sweep_provider(combinations, price_provider)
+    substrat_cache = {}
+
+    pvs, rebalances = {}, {}
+    for no_combination, (values, parameters) in enumerate(combinations):
+        if random_seed is not None:
+            np.random.seed(random_seed)
+        label = ', '.join(f'{key}={value}' for key, value in values.items())
+        try:
+            pv = combination_pv(parameters, target, shared_provider, substrat_cache)
+        except Exception as e:
+            print(f'SqError. Walk-forward combination {no_combination} {values} failed. {type(e).__name__}: {e}')
+            continue
+        meta_parameters = parameters['meta_parameters'] # the meta and the leveraged PVs are rebalanced on the meta rebalance days of their own index
+        pvs[label] = pv
+        rebalances[label] = pd.Series(ccal.rebalance_days(pv.index, meta_parameters['meta_rebalance_unit'], meta_parameters['meta_rebalance_freq'], meta_parameters['meta_rebalance_shift']), index = pv.index)
+        print(f'Walk-forward run {no_combination + 1}/{len(combinations)}: {values}')
+    if len(pvs) == 0:
+        raise RuntimeError('SqError. All the walk-forward combinations failed.')
+    pvs_df = pd.concat(pvs, axis = 1)
+    rebalance = pd.concat(rebalances, axis = 1).reindex(pvs_df.index).fillna(False).to_numpy(dtype = bool)
+
+    windows = walk_forward_windows(base_parameters['meta_parameters']['meta_start_date'], pvs_df.index[-1], in_sample_years, out_of_sample_years, anchored)
+    if len(windows) == 0:
+        raise ValueError(f'SqError. The period until {pvs_df.index[-1].date()} is shorter than the {in_sample_years} in-sample years, there is no walk-forward window.')
+    window_rows, in_sample_metrics, oos_segments, selected_segments = [], [], [], []
+    for no_window, (is_start, oos_start, oos_end) in enumerate(windows):
+        last_window = no_window == len(windows) - 1
+        is_metrics = cpa.perf_metrics(window_pvs(pvs_df, rebalance, is_start, oos_start))
+        oos_pvs = window_pvs(pvs_df, rebalance, oos_start, oos_end, last_window)
+        selected = is_metrics[select_metric].idxmin() if select_metric == 'MDD' else is_metrics[select_metric].idxmax()
+        oos_selected_metric = cpa.perf_metrics(oos_pvs[selected])[select_metric].iloc[0]
+        window_rows.append({'window' : no_window, 'in_sample_start' : is_start, 'out_of_sample_start' : oos_start, 'out_of_sample_end' : oos_end, 'selected' : selected,
+                            f'in_sample_{select_metric}' : is_metrics.loc[selected, select_metric], f'out_of_sample_{select_metric}' : oos_selected_metric})
+        in_sample_metrics.append(is_metrics.rename_axis('combination').reset_index().assign(window = no_window))
+        oos_segments.append(oos_pvs)
+        selected_segments.append(oos_pvs[selected].rename('walk_forward'))
+        print(f'Walk-forward window {no_window + 1}/{len(windows)}: in-sample {is_start.date()} - {oos_start.date()}, selected {selected}, out-of-sample {select_metric}: {oos_selected_metric:.3f}')
+
+    out_of_sample_pvs = pd.concat([stitched_pvs(oos_segments), stitched_pvs(selected_segments)], axis = 1)
+    return {'windows' : pd.DataFrame(window_rows), 'in_sample_metrics' : pd.concat(in_sample_metrics, ignore_index = True)[['window', 'combination'] + cpa.perf_metric_names],
+            'out_of_sample_pvs' : out_of_sample_pvs, 'out_of_sample_metrics' : cpa.perf_metrics(out_of_sample_pvs)}
@@ -0,0 +1,66 @@
+# Regression tests of the sample and hold engine (com.hold_forward) against the former day loops of leveraged_meta_lib.weight_recalc and lev_by_rank.
+# The rebalance days include the first row, consecutive days and a long trailing segment after the last rebalance. Run: python -m pytest test_hold_forward.py
+
+import numpy as np
+import pandas as pd
+import common_aa_pv as com
+import leveraged_meta_lib
+
+def loop_weight_recalc(reb_day_p, cum_weights_p):
+    # the original loop of leveraged_meta_lib.weight_recalc
+    no_rows, no_cols = cum_weights_p.shape
+    new_weights = np.zeros((no_rows, no_cols))
+    for i in range(1, no_rows):
+        for j in range(no_cols):
+            if reb_day_p[i-1] == True:
+                new_weights[i, j] = cum_weights_p[i-1, j]
+            else:
+                new_weights[i, j] = new_weights[i-1, j]
+    return new_weights
+
+def loop_lev_by_rank(rank_mx_p, leverage_array_p, lb_days_p, reb_day_p):
+    # the original loop of leveraged_meta_lib.lev_by_rank
+    no_rows, no_cols = rank_mx_p.shape
+    rank_based_leverages = np.ones((no_rows, no_cols))
+    for no_days in range(lb_days_p, no_rows):
+        for etfs in range(no_cols):
+            if reb_day_p[no_days] == True:
+                rank_based_leverages[no_days, etfs] = leverage_array_p[rank_mx_p[no_days, etfs] - 1]
+            else:
+                rank_based_leverages[no_days, etfs] = rank_based_leverages[no_days - 1, etfs]
+    return rank_based_leverages
+
+def rebalance_days(no_rows):
+    rebalance = np.zeros(no_rows, dtype = bool)
+    rebalance[0] = True # rebalance on the first row
+    rebalance[[5, 6, 7]] = True # consecutive rebalances
+    rebalance[21:no_rows - 200:21] = True # monthly, then a trailing segment of 200 days without rebalance
+    rebalance[251:254] = True # consecutive rebalances around the end of the lookback warm-up
+    return rebalance
+
+def rank_panel(no_rows, no_cols):
+    rng = np.random.default_rng(7)
+    ranks = np.argsort(rng.random((no_rows, no_cols)), axis = 1) + 1
+    index = pd.bdate_range('2012-01-02', periods = no_rows)
+    return pd.DataFrame(ranks, index = index, columns = [f'S{j}' for j in range(no_cols)])
+
+def test_weight_recalc_equals_loop():
+    rng = np.random.default_rng(3)
+    no_rows = 700
+    cum_weights = pd.DataFrame(rng.random((no_rows, 4)), index = pd.bdate_range('2012-01-02', periods = no_rows), columns = list('abcd'))
+    rebalance = rebalance_days(no_rows)
+    expected = loop_weight_recalc(rebalance, cum_weights.to_numpy())
+    np.testing.assert_array_equal(com.hold_forward(cum_weights.to_numpy(), rebalance, 0, 0, 1), expected)
+    np.testing.assert_array_equal(leveraged_meta_lib.weight_recalc(rebalance, cum_weights).to_numpy(), expected)
+    no_rebalance = np.zeros(no_rows, dtype = bool)
+    np.testing.assert_array_equal(leveraged_meta_lib.weight_recalc(no_rebalance, cum_weights).to_numpy(), loop_weight_recalc(no_rebalance, cum_weights.to_numpy()))
+
+def test_lev_by_rank_equals_loop():
+    no_rows = 700
+    rank_df = rank_panel(no_rows, 5)
+    leverage_array = [2.0, 1.5, 1.2, 1.0, 0.5]
+    rebalance = rebalance_days(no_rows)
+    for min_lb_years in [0, 1]:
+        expected = loop_lev_by_rank(rank_df.to_numpy(), leverage_array, min_lb_years * 252, rebalance)
+        np.testing.assert_array_equal(com.hold_forward(com.rank_lookup(rank_df.to_numpy(), leverage_array), rebalance, 1, min_lb_years * 252), expected)
+        np.testing.assert_array_equal(leveraged_meta_lib.lev_by_rank(rank_df, leverage_array, min_lb_years, rebalance).to_numpy(), expected)
@@ -0,0 +1,62 @@
+# Regression tests of the expanding month of year statistics (com.expanding_month_stats) against the former per-year groupby of leveraged_meta_lib.yearly_sharpe.
+# The PV starts in March (a partial first year, the first months have no values) and has a month with a single day (std with ddof 1 is NaN) and a constant month.
+# Run: python -m pytest test_month_stats.py
+
+import warnings
+import numpy as np
+import pandas as pd
+import common_aa_pv as com
+import leveraged_meta_lib
+
+def groupby_yearly_sharpe(pv_p):
+    # the original year / month selection loop of leveraged_meta_lib.yearly_sharpe
+    daily_profit_df = (pv_p.copy())
+    daily_profit_df.columns = ['PV']
+    daily_profit_df['Year'], daily_profit_df['Month'] = daily_profit_df.index.year, daily_profit_df.index.month
+    daily_profit_df['Profit'] = daily_profit_df.PV / daily_profit_df.PV.shift(1) - 1
+    years_played = np.array(sorted(daily_profit_df.Year.unique()))
+    no_years = len(years_played)
+    no_months = 12
+    avg_mtx = np.zeros((no_years, no_months))
+    std_mtx = np.zeros((no_years, no_months))
+    sharpe_mtx = np.zeros((no_years, no_months))
+    for i in range(no_years):
+        for j in range(no_months):
+            avg_mtx[i, j] = daily_profit_df.loc[(daily_profit_df['Year'] <= years_played[i]) & (daily_profit_df['Month'] == j+1), 'Profit'].mean() * 252
+            std_mtx[i, j] = daily_profit_df.loc[(daily_profit_df['Year'] <= years_played[i]) & (daily_profit_df['Month'] == j+1), 'Profit'].std() * np.sqrt(252)
+            sharpe_mtx[i, j] = avg_mtx[i, j] / std_mtx[i, j]
+    sharpe_df = pd.DataFrame(sharpe_mtx, index = years_played)
+    sharpe_df.columns += 1
+    return sharpe_df, avg_mtx / 252, std_mtx / np.sqrt(252)
+
+def partial_year_pv():
+    rng = np.random.default_rng(13)
+    index = pd.bdate_range('2015-03-16', '2019-06-28')
+    index = index[(index.year != 2015) | (index.month != 5) | (index.day == 12)] # a single day in May of the first year
+    profits = rng.normal(4e-4, 1e-2, len(index))
+    profits[index.month == 8] = 0.0 # a constant month: the PV doesn't move in August
+    pv = 100 * np.cumprod(1 + profits)
+    return pd.DataFrame({'PV' : pv}, index = index)
+
+def test_expanding_month_stats_equals_groupby():
+    pv_df = partial_year_pv()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected_sharpe, expected_mean, expected_std = groupby_yearly_sharpe(pv_df)
+    profit = (pv_df.PV / pv_df.PV.shift(1) - 1).to_numpy()
+    month_stats = com.expanding_month_stats(pv_df.index, profit)
+    np.testing.assert_array_equal(month_stats['years'], expected_sharpe.index.to_numpy())
+    np.testing.assert_allclose(month_stats['mean'], expected_mean, rtol = 1e-10, atol = 1e-15)
+    np.testing.assert_allclose(month_stats['std'], expected_std, rtol = 1e-10, atol = 1e-15)
+    assert np.isnan(month_stats['std'][0, 4]) # May of the first year has a single value
+    assert np.all(month_stats['std'][:, 7] == 0) # August is constant, the std is exactly 0 (the Sharpe is NaN like in the groupby)
+
+def test_yearly_sharpe_equals_groupby():
+    pv_df = partial_year_pv()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected_sharpe = groupby_yearly_sharpe(pv_df)[0]
+    sharpe_df = leveraged_meta_lib.yearly_sharpe(pv_df)
+    np.testing.assert_array_equal(sharpe_df.index.to_numpy(), expected_sharpe.index.to_numpy())
+    np.testing.assert_array_equal(sharpe_df.columns.to_numpy(), expected_sharpe.columns.to_numpy())
+    np.testing.assert_allclose(sharpe_df.to_numpy(), expected_sharpe.to_numpy(), rtol = 1e-8)
@@ -0,0 +1,93 @@
+# Regression tests of the rebalance segment PV kernel (com.segment_pv) against the former day loops of positions_pv and positions_pv_ew.
+# The kernel keeps the arithmetic of the loops, the positions, cash and PVs have to be equal bit for bit: the rounding noise decides rank ties in meta().
+# The panel has missing prices (a late listing and gaps), rows of zero weights and rebalance days on the first rows. Run: python -m pytest test_positions_pv.py
+
+import numpy as np
+import pandas as pd
+import common_aa_pv as com
+
+def loop_positions_pv(acp_p, rebalance_p, weights_p, cash_weight_p, start_date_p):
+    # the original loop of com.positions_pv (with 1 dimensional pv and cash arrays)
+    adjclose = acp_p.fillna(1).to_numpy()
+    rebalanceday = rebalance_p.to_numpy()
+    weights = weights_p.fillna(0).to_numpy()
+    cash_weight = cash_weight_p.to_numpy()
+    no_rows, no_cols = acp_p.shape
+    positions = np.zeros((no_rows, no_cols))
+    pv = np.ones(no_rows)
+    cash = np.ones(no_rows)
+    start_ind = np.argmax(acp_p.index >= start_date_p)
+    for i in range(start_ind, no_rows):
+        pv[i] = 0
+        for j in range(no_cols):
+            if rebalanceday[i-1] == True:
+                positions[i,j] = pv[i-1] * weights[i-1,j] / adjclose[i-1,j]
+            else:
+                positions[i,j] = positions[i-1,j]
+            pv[i] += positions[i,j] * adjclose[i,j]
+        if rebalanceday[i-1] == True:
+            cash[i] = pv[i-1] * cash_weight[i-1]
+        else:
+            cash[i] = cash[i-1]
+        pv[i] += cash[i]
+    return positions[start_ind-1:], cash[start_ind-1:], pv[start_ind-1:]
+
+def loop_positions_pv_ew(acp_p, rebalance_p, start_date_p):
+    # the original loop of com.positions_pv_ew (with 1 dimensional pv and cash arrays)
+    adjclose = acp_p.fillna(0).to_numpy()
+    rebalanceday = rebalance_p.to_numpy()
+    no_rows, no_cols = acp_p.shape
+    no_ava_etfs = (acp_p > 0).sum(1).to_numpy()
+    positions = np.zeros((no_rows, no_cols))
+    pv = np.ones(no_rows)
+    cash = np.ones(no_rows)
+    start_ind = np.argmax(acp_p.index >= start_date_p)
+    for i in range(start_ind, no_rows):
+        pv[i] = 0
+        for j in range(no_cols):
+            if rebalanceday[i-1] == True:
+                positions[i,j] = pv[i-1] * (1 / no_ava_etfs[i-1]) / adjclose[i-1,j] if adjclose[i-1, j] > 0 else 0
+            else:
+                positions[i,j] = positions[i-1,j]
+            pv[i] += positions[i,j] * adjclose[i,j]
+        cash[i] = 0
+        pv[i] += cash[i]
+    return positions[start_ind-1:], cash[start_ind-1:], pv[start_ind-1:]
+
+def gap_panel():
+    rng = np.random.default_rng(11)
+    index = pd.bdate_range('2018-01-01', periods = 160)
+    prices = pd.DataFrame(40 * np.exp(np.cumsum(rng.normal(3e-4, 1e-2, (160, 4)), axis = 0)), index = index, columns = list('abcd'))
+    prices.iloc[:30, 0] = np.nan # listed later
+    prices.iloc[[50, 51, 90], 2] = np.nan # missing days
+    weights = pd.DataFrame(rng.random((160, 4)), index = index, columns = prices.columns)
+    weights = weights.div(weights.sum(axis = 1) * 1.25, axis = 0)
+    weights.iloc[60:75] = 0.0 # all cash
+    weights.iloc[[40, 41], 1] = np.nan
+    cash_weight = 1 - weights.sum(axis = 1)
+    return prices, weights, cash_weight
+
+def rebalance_days(index, every):
+    rebalance = pd.Series(np.arange(len(index)) % every == 0, index = index)
+    rebalance.iloc[[0, 1, 2]] = True # rebalance on the first day and on consecutive days
+    return rebalance
+
+def assert_equal_results(result, expected):
+    for value, expected_value in zip(result, expected):
+        np.testing.assert_array_equal(np.asarray(value, dtype = float), expected_value)
+
+def test_positions_pv_equals_loop():
+    prices, weights, cash_weight = gap_panel()
+    for every in [1, 7, 21]:
+        rebalance = rebalance_days(prices.index, every)
+        for start_date in [prices.index[0] - pd.Timedelta(days = 3), prices.index[1], prices.index[10], prices.index[-1]]:
+            result = com.positions_pv(prices, rebalance, weights, cash_weight, start_date)
+            assert_equal_results(result, loop_positions_pv(prices, rebalance, weights, cash_weight, start_date))
+
+def test_positions_pv_ew_equals_loop():
+    prices, weights, cash_weight = gap_panel()
+    for every in [1, 7, 21]:
+        rebalance = rebalance_days(prices.index, every)
+        for start_date in [prices.index[0] - pd.Timedelta(days = 3), prices.index[1], prices.index[10], prices.index[-1]]:
+            result = com.positions_pv_ew(prices, rebalance, start_date)
+            assert_equal_results(result, loop_positions_pv_ew(prices, rebalance, start_date))
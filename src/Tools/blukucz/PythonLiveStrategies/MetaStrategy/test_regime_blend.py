@@ -0,0 +1,78 @@
+# Regression tests of the regime switching weights (com.regime_blend) against the former canary loops of baa_lib (agg_def, bal_def) and haa_lib (off_def).
+# The canary signal is calculated like in the libs from canary prices with a warm-up and a missing stretch (NaN momentum rows are defensive),
+# it switches between the regimes and has a long all-defensive period. Run: python -m pytest test_regime_blend.py
+
+import numpy as np
+import pandas as pd
+import common_aa_pv as com
+
+def loop_concat_blend(canary_signal_p, offensive_weights_p, defensive_weights_p):
+    # the original canary loop of baa_lib.baa: offensive weights if the canary signal is 1, defensive weights otherwise, the blocks side by side
+    offensive_weights_helper = np.array(offensive_weights_p)
+    defensive_weights_helper = np.array(defensive_weights_p)
+    no_off_etfs, no_def_etfs = offensive_weights_p.shape[1], defensive_weights_p.shape[1]
+    off_def_df = pd.concat([offensive_weights_p, defensive_weights_p], axis = 1)
+    no_rows, no_cols = off_def_df.shape
+    off_def_weights_helper = np.zeros((no_rows, no_cols))
+    for i in range(no_rows):
+        if canary_signal_p[i] == 1:
+            for j in range(no_off_etfs):
+                off_def_weights_helper[i, j] = offensive_weights_helper[i, j]
+        else:
+            for j in range(no_def_etfs):
+                off_def_weights_helper[i, j + no_off_etfs] = defensive_weights_helper[i, j]
+    return pd.DataFrame(off_def_weights_helper, index = off_def_df.index, columns = off_def_df.columns)
+
+def loop_union_blend(canary_signal_p, off_def_base_weights_p, defensive_weights_p):
+    # the original canary loop of haa_lib.haa: the same blocks, then one column per ticker (groupby(axis = 1).sum() of the original) in sorted order
+    off_def_weights = loop_concat_blend(canary_signal_p, off_def_base_weights_p, defensive_weights_p)
+    return off_def_weights.T.groupby(level = 0).sum().T.sort_index(axis = 1)
+
+def canary_panel():
+    rng = np.random.default_rng(17)
+    no_rows = 900
+    index = pd.bdate_range('2016-01-04', periods = no_rows)
+    drift = np.full((no_rows, 2), 6e-4)
+    drift[450:650] = -3e-3 # falling canary prices: all defensive
+    canary_df = pd.DataFrame(100 * np.exp(np.cumsum(drift + rng.normal(0, 8e-3, (no_rows, 2)), axis = 0)), index = index, columns = ['VWO', 'BND'])
+    canary_df.iloc[300:320, 1] = np.nan # missing canary prices: NaN momentum rows
+    canary_lbs = np.array([1, 3, 6, 12]) * 21
+    canary_rets = sum((canary_df / canary_df.shift(lb) - 1) * weight for lb, weight in zip(canary_lbs, [12, 4, 2, 1]))
+    canary_signal = np.array((canary_rets > 0).sum(1) / canary_df.shape[1])
+    return index, canary_signal
+
+def weight_block(index, columns, seed):
+    rng = np.random.default_rng(seed)
+    weights = pd.DataFrame(rng.random((len(index), len(columns))), index = index, columns = columns)
+    weights = weights.div(weights.sum(axis = 1) * 1.1, axis = 0)
+    weights.iloc[::5, 0] = 0.0
+    return weights
+
+def test_canary_signal_panel():
+    index, canary_signal = canary_panel()
+    canary_on = canary_signal == 1
+    assert not canary_on[:252].any() # momentum warm-up, NaN canary rows
+    assert not canary_on[300:320].any() # missing canary prices
+    assert not canary_on[500:650].any() # all defensive
+    assert np.count_nonzero(np.diff(canary_on.astype(int))) > 10 # regime switches
+
+def test_concat_blend_equals_loop():
+    index, canary_signal = canary_panel()
+    canary_on = canary_signal == 1
+    aggressive_weights = weight_block(index, ['SPY', 'QQQ', 'EFA', 'EEM'], 1)
+    defensive_weights = weight_block(index, ['TIP', 'IEF', 'BIL'], 2)
+    aggressive_weights.iloc[:252] = np.nan # no momentum in the warm-up, only the defensive block is used there
+    expected = loop_concat_blend(canary_signal, aggressive_weights, defensive_weights)
+    result = com.regime_blend(np.column_stack((canary_on, ~canary_on)), [aggressive_weights, defensive_weights])
+    assert list(result.columns) == list(expected.columns)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+
+def test_union_blend_equals_loop():
+    index, canary_signal = canary_panel()
+    canary_on = canary_signal == 1
+    off_def_base_weights = weight_block(index, ['SPY', 'IEF', 'EFA', 'BIL'], 3) # offensive and defensive tickers, in set order
+    defensive_weights = weight_block(index, ['IEF', 'BIL'], 4)
+    expected = loop_union_blend(canary_signal, off_def_base_weights, defensive_weights)
+    result = com.regime_blend(np.column_stack((canary_on, ~canary_on)), [off_def_base_weights, defensive_weights], 'union')
+    assert list(result.columns) == list(expected.columns)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
@@ -0,0 +1,52 @@
+# Regression tests of the rolling co-moment engine (com.rolling_comoments) against pandas and np.corrcoef.
+# The panel has a constant stretch (zero returns) and a missing stretch: a constant window must give NaN correlations, like pandas and np.corrcoef,
+# and must not count in the average of the other ETFs. Run: python -m pytest test_rolling_corr.py
+
+import warnings
+import numpy as np
+import pandas as pd
+import common_aa_pv as com
+import dualmom_opt3_lib
+
+def constant_gap_panel():
+    rng = np.random.default_rng(5)
+    dailyret = pd.DataFrame(rng.normal(3e-4, 1e-2, (600, 5)), index = pd.bdate_range('2015-01-01', periods = 600), columns = list('abcde'))
+    dailyret.iloc[0] = np.nan
+    dailyret.iloc[150:450, 2] = 0.0 # constant price
+    dailyret.iloc[300:370, 4] = np.nan # missing prices
+    return dailyret
+
+def corrcoef_opt3corr(dailyret_p, total_rank_p, number_of_ETFs_p, lb_days_p):
+    # the original np.corrcoef loop of dualmom_opt3_lib.opt3corr
+    rets, ranks, no_etfs = dailyret_p.to_numpy(), total_rank_p.to_numpy(), number_of_ETFs_p.to_numpy()
+    no_rows, no_cols = rets.shape
+    opt3corr = np.zeros((no_rows, no_cols)) + 99
+    for i in range(lb_days_p - 1, no_rows):
+        for j in range(no_cols):
+            sub_corrs = np.zeros(no_cols)
+            if ranks[i, j] < no_etfs[i] + 1:
+                for j2 in range(no_cols):
+                    if ranks[i, j2] < no_etfs[i] + 1:
+                        sub_corrs[j2] = np.corrcoef(rets[i - lb_days_p + 1 : i, j], rets[i - lb_days_p + 1 : i, j2])[1, 0]
+                opt3corr[i, j] = np.mean(sub_corrs)
+    return opt3corr
+
+def test_rolling_avg_corr_constant_and_missing_windows():
+    dailyret = constant_gap_panel()
+    for lb in [21, 84, 85]:
+        avg_corr = com.rolling_avg_corr(dailyret, lb).to_numpy()
+        expected = dailyret.rolling(lb).corr().groupby(level = 0).mean().to_numpy()
+        np.testing.assert_array_equal(np.isnan(avg_corr), np.isnan(expected))
+        np.testing.assert_allclose(avg_corr, expected, rtol = 0, atol = 1e-11)
+
+def test_opt3corr_constant_and_missing_windows():
+    dailyret = constant_gap_panel()
+    total_rank = pd.DataFrame(np.tile(np.arange(1, 6), (len(dailyret), 1)), index = dailyret.index, columns = dailyret.columns)
+    number_of_ETFs = pd.Series(4, index = dailyret.index)
+    for lb in [22, 85, 86]:
+        opt3corr = dualmom_opt3_lib.opt3corr(dailyret, total_rank, number_of_ETFs, lb).to_numpy()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # np.corrcoef warns on the constant windows
+            expected = corrcoef_opt3corr(dailyret, total_rank, number_of_ETFs, lb)
+        np.testing.assert_array_equal(np.isnan(opt3corr), np.isnan(expected))
+        np.testing.assert_allclose(opt3corr, expected, rtol = 0, atol = 1e-13)
@@ -0,0 +1,62 @@
+# Regression tests of the walk-forward out-of-sample PVs (com.restarted_pvs and the window / stitching steps of param_sweep_lib.walk_forward)
+# against independent com.segment_pv simulations started with 1 cash at the beginning of each out-of-sample window, chained into one equity curve.
+# Two strategies with their own rebalance days (monthly and weekly) on a synthetic panel with missing prices. Run: python -m pytest test_walk_forward.py
+
+import numpy as np
+import pandas as pd
+import common_aa_pv as com
+import param_sweep_lib
+
+def synthetic_strategies():
+    rng = np.random.default_rng(23)
+    index = pd.bdate_range('2014-01-15', '2019-09-30')
+    no_rows = len(index)
+    prices = 50 * np.exp(np.cumsum(rng.normal(3e-4, 1e-2, (no_rows, 5)), axis = 0))
+    prices[:40, 3] = np.nan # listed later
+    prices[700:710, 1] = np.nan # missing days
+    adjclose = np.where(np.isnan(prices), 1, prices) # like positions_pv
+    weights = rng.random((2, no_rows, 5))
+    weights[:, :40, 3] = 0.0
+    weights = weights / (weights.sum(axis = 2, keepdims = True) * 1.2)
+    cash_weight = 1 - weights.sum(axis = 2)
+    rebalance = np.column_stack((np.r_[index.month[1:] != index.month[:-1], False], index.dayofweek == 4)) # last days of the months and Fridays
+    return index, adjclose, weights, cash_weight, rebalance
+
+def simulated_pv(adjclose, rebalance, weights, cash_weight, start_ind):
+    return com.segment_pv(adjclose, rebalance, weights[None], cash_weight[None], start_ind, 1)[2][0]
+
+def test_stitched_walk_forward_equals_window_runs():
+    index, adjclose, weights, cash_weight, rebalance = synthetic_strategies()
+    full_start_ind = 5
+    pvs_df = pd.DataFrame({k : simulated_pv(adjclose, rebalance[:, k], weights[k], cash_weight[k], full_start_ind)[full_start_ind-1:] for k in range(2)}, index = index[full_start_ind-1:])
+    rebalance_sel = rebalance[full_start_ind-1:]
+    windows = param_sweep_lib.walk_forward_windows(index[full_start_ind], pvs_df.index[-1], 2, 1)
+    assert len(windows) == 4
+
+    segments = []
+    for no_window, (is_start, oos_start, oos_end) in enumerate(windows):
+        last_window = no_window == len(windows) - 1
+        oos_pvs = param_sweep_lib.window_pvs(pvs_df, rebalance_sel, oos_start, oos_end, last_window)
+        start_ind = np.argmax(index >= oos_start)
+        in_window = (index <= oos_end) if last_window else (index < oos_end)
+        for k in range(2):
+            # an independent simulation with 1 cash from the window start, idle until its first rebalance
+            window_pv = simulated_pv(adjclose, rebalance[:, k], weights[k], cash_weight[k], start_ind)
+            expected = window_pv[start_ind-1:][in_window[start_ind-1:]]
+            np.testing.assert_array_equal(oos_pvs.index, index[start_ind-1:][in_window[start_ind-1:]])
+            np.testing.assert_allclose(oos_pvs[k].to_numpy(), expected, rtol = 1e-12)
+        segments.append(oos_pvs)
+
+    # the segments chained by hand: every window continues from the last PV of the previous window (their common day)
+    stitched = param_sweep_lib.stitched_pvs(segments)
+    assert stitched.index.is_unique and stitched.index.is_monotonic_increasing
+    for k in range(2):
+        expected_parts, level = [], 1.0
+        for no_window, (is_start, oos_start, oos_end) in enumerate(windows):
+            last_window = no_window == len(windows) - 1
+            start_ind = np.argmax(index >= oos_start)
+            in_window = (index <= oos_end) if last_window else (index < oos_end)
+            window_pv = simulated_pv(adjclose, rebalance[:, k], weights[k], cash_weight[k], start_ind)[start_ind-1:][in_window[start_ind-1:]]
+            expected_parts.append(window_pv * level if no_window == 0 else window_pv[1:] * level)
+            level = level * window_pv[-1]
+        np.testing.assert_allclose(stitched[k].to_numpy(), np.concatenate(expected_parts), rtol = 1e-12)